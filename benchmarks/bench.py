@@ -0,0 +1,402 @@
+"""Benchmarks for the hot paths of the store, the lists and the taskserver
+
+Synthetic lists of `ToDo`, `Line` and the template type `Task` (see
+`plugins/tasks.py`) are generated for each size and every benchmark is
+run against them, reporting its best time over `--repeat` runs, its
+throughput in entries per second and its peak memory, measured with
+tracemalloc in a separate run so that tracing does not skew the time.
+
+Everything runs in a scratch directory which is used as $HOME, so the
+lists and the servers never touch ~/.cap.
+
+    python -m benchmarks.bench                      # 1k and 100k entries
+    python -m benchmarks.bench --sizes 1000 10000000 --only 'entries*'
+    python -m benchmarks.bench --save baseline.json
+    python -m benchmarks.bench --baseline baseline.json --tolerance 0.2
+
+Results are written as JSON to stdout, or to `--output`. With a baseline
+the benchmarks which got slower, or used more memory, by more than the
+tolerance are listed on stderr and the exit status is 1.
+"""
+from argparse import ArgumentParser
+from fnmatch import fnmatch
+from pathlib import Path
+import asyncio
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SIZES = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+DEFAULT_SIZES = (1_000, 100_000)
+PLUGINS = Path(__file__).parent/'plugins'
+
+# how each type's synthetic entries look
+GENERATORS = {
+        'ToDo': lambda i: f'TODO: item {i}',
+        'Line': lambda i: f'line {i}',
+        'Task': lambda i: f'TASK {i % 10} title {i}',
+}
+
+benchmarks = []
+
+
+def benchmark(name):
+    """register a benchmark. the function is called with a Fixture before
+    every run and returns the function to time and how many entries it
+    processes"""
+    def register(setup):
+        benchmarks.append((name, setup))
+        return setup
+    return register
+
+
+class Fixture:
+    """the synthetic list for one type and size. the list is generated once
+    and copied into place for each run, so that runs which change it start
+    from the same file
+
+    Args:
+        workdir (:obj: pathlib.Path): the scratch directory
+        typename (str): the name of the TextObject type
+        size (int): how many entries the list has
+    """
+    def __init__(self, workdir, typename, size):
+        from cap import textobjecttypes
+        self.workdir = workdir
+        self.typename = typename
+        self.textobjectcls = textobjecttypes[typename]
+        self.size = size
+        self.generate = GENERATORS[typename]
+        self.source = workdir/'sources'/f'{typename}-{size}.txt'
+        if not self.source.exists():
+            self.source.parent.mkdir(parents=True, exist_ok=True)
+            with self.source.open('w') as f:
+                for start in range(0, size, 100_000):
+                    f.write(''.join(f'{self.generate(i)}\n'
+                        for i in range(start, min(start + 100_000, size))))
+
+    def copy(self, name='list'):
+        """a fresh copy of the list
+
+        Returns:
+            the path of the copy
+        """
+        path = self.workdir/'runs'/f'{name}.txt'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.source, path)
+        return path
+
+    def textobjectfile(self, **kwargs):
+        from cap.store.textobjectfiles import TextObjectFile
+        return TextObjectFile(self.copy(), self.textobjectcls, **kwargs)
+
+    def spread(self, count):
+        """the text of `count` entries spread evenly through the list"""
+        step = max(self.size // count, 1)
+        return [self.generate(i) for i in range(0, self.size, step)][:count]
+
+    def group_index(self):
+        """the path of a group index listing `size` lists of the type. the
+        lists themselves only exist once they are opened"""
+        path = self.workdir/'runs'/'group.txt'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lists = self.workdir/'runs'/'lists'
+        with path.open('w') as f:
+            for start in range(0, self.size, 100_000):
+                f.write(''.join(f'{lists}/list{i}.txt {self.typename}\n'
+                    for i in range(start, min(start + 100_000, self.size))))
+        return path
+
+
+@benchmark('findall')
+def findall(fixture):
+    text = fixture.source.read_text()
+    return lambda: fixture.textobjectcls.findall(text), fixture.size
+
+
+@benchmark('entries')
+def entries(fixture):
+    textobjectfile = fixture.textobjectfile()
+    return lambda: sum(1 for _ in textobjectfile.entries()), fixture.size
+
+
+@benchmark('entries_lazy')
+def entries_lazy(fixture):
+    textobjectfile = fixture.textobjectfile()
+    return lambda: sum(1 for _ in textobjectfile.entries(lazy=True)), fixture.size
+
+
+@benchmark('entries_processes')
+def entries_processes(fixture):
+    textobjectfile = fixture.textobjectfile()
+    return lambda: sum(1 for _ in textobjectfile.entries(processes=True)), fixture.size
+
+
+@benchmark('add')
+def add(fixture):
+    textobjectfile = fixture.textobjectfile()
+    items = [fixture.generate(fixture.size + i) for i in range(1000)]
+    return lambda: textobjectfile.add(*items), len(items)
+
+
+@benchmark('remove')
+def remove(fixture):
+    textobjectfile = fixture.textobjectfile()
+    items = fixture.spread(100)
+    return lambda: textobjectfile.remove(*items), fixture.size
+
+
+@benchmark('replace')
+def replace(fixture):
+    textobjectfile = fixture.textobjectfile()
+    item = fixture.generate(fixture.size // 2)
+    return lambda: textobjectfile.replace(item, fixture.generate(fixture.size)), fixture.size
+
+
+@benchmark('contains')
+def contains(fixture):
+    textobjectfile = fixture.textobjectfile()
+    item = fixture.generate(fixture.size - 1)
+    return lambda: item in textobjectfile, fixture.size
+
+
+@benchmark('getitem_indexed')
+def getitem_indexed(fixture):
+    textobjectfile = fixture.textobjectfile(index=True)
+    return lambda: textobjectfile[fixture.size // 2], fixture.size
+
+
+@benchmark('cold_page_snapshot')
+def cold_page_snapshot(fixture):
+    from cap.store.parsecache import ParseCache
+    textobjectfile = fixture.textobjectfile(snapshot=True)
+    len(textobjectfile)
+    def cold_page():
+        # a new process: nothing cached, only the snapshot on disk
+        opened = type(textobjectfile)(textobjectfile.path, fixture.textobjectcls,
+                cache=ParseCache(), snapshot=True)
+        return opened[:50], len(opened)
+    return cold_page, fixture.size
+
+
+@benchmark('group_lookup')
+def group_lookup(fixture):
+    from cap.store.textobjectfiles import TextObjectFileGroup
+    group = TextObjectFileGroup(fixture.group_index())
+    return lambda: group[f'list{fixture.size - 1}'], fixture.size
+
+
+@benchmark('listset_lookup')
+def listset_lookup(fixture):
+    from cap.lists.lists import ListSet
+    lists = ListSet(fixture.group_index(), fixture.workdir/'runs'/'lists')
+    def lookup():
+        for i in range(0, fixture.size, max(fixture.size // 100, 1)):
+            lists[f'list{i}']
+    return lookup, fixture.size
+
+
+@benchmark('listset_create_delete')
+def listset_create_delete(fixture):
+    from cap.lists.lists import ListSet
+    lists = ListSet(fixture.group_index(), fixture.workdir/'runs'/'lists')
+    def create_delete():
+        lists.add('created', fixture.typename)
+        del lists['created']
+    return create_delete, fixture.size
+
+
+def served(fixture):
+    """install the list as `benchlist` in the scratch ~/.cap, for the
+    endpoints to serve"""
+    from cap.lists.lists import main_list_set
+    if 'benchlist' in main_list_set:
+        del main_list_set['benchlist']
+    main_list_set.add('benchlist', fixture.typename)
+    shutil.copyfile(fixture.source, main_list_set['benchlist'].path)
+    return main_list_set['benchlist']
+
+
+def request(method, path, body=None):
+    from cap.taskserver.aioserver import Request, dispatch
+    body = json.dumps(body).encode() if body is not None else b''
+    status, _, response = asyncio.run(dispatch(Request(method, path, {}, body)))
+    if status != 200:
+        raise RuntimeError(f'{method} {path} returned {status}: {response}')
+    return response
+
+
+@benchmark('aioserver_page')
+def aioserver_page(fixture):
+    served(fixture)
+    return lambda: request('GET', '/list/benchlist?offset=0&limit=100'), 100
+
+
+@benchmark('aioserver_add')
+def aioserver_add(fixture):
+    served(fixture)
+    items = [fixture.generate(fixture.size + i) for i in range(100)]
+    return lambda: request('POST', '/add/benchlist', {'items': items}), len(items)
+
+
+@benchmark('aioserver_remove')
+def aioserver_remove(fixture):
+    served(fixture)
+    items = fixture.spread(100)
+    return lambda: request('POST', '/remove/benchlist', {'items': items}), fixture.size
+
+
+def flask_client():
+    """a test client for the flask taskserver, or None if flask is not installed"""
+    try:
+        from cap.taskserver.app import app
+        return app.test_client()
+    except (ImportError, AttributeError):
+        return None
+
+
+def flask_request(client, method, path, body=None):
+    response = client.open(path, method=method, json=body)
+    if response.status_code != 200:
+        raise RuntimeError(f'{method} {path} returned {response.status_code}: {response.data}')
+    return response
+
+
+@benchmark('flask_page')
+def flask_page(fixture):
+    client = flask_client()
+    if client is None:
+        return None
+    served(fixture)
+    return lambda: flask_request(client, 'GET', '/list/benchlist?offset=0&limit=100'), 100
+
+
+@benchmark('flask_add')
+def flask_add(fixture):
+    client = flask_client()
+    if client is None:
+        return None
+    served(fixture)
+    items = [fixture.generate(fixture.size + i) for i in range(100)]
+    return lambda: flask_request(client, 'POST', '/add/benchlist', {'items': items}), len(items)
+
+
+def measure(setup, fixture, repeat):
+    """run a benchmark
+
+    Returns:
+        a dict of the results, or None if the benchmark can't run here
+    """
+    timings = []
+    for _ in range(repeat):
+        prepared = setup(fixture)
+        if prepared is None:
+            return None
+        run, count = prepared
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    run, count = setup(fixture)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    seconds = min(timings)
+    return {
+            'seconds': seconds,
+            'throughput': count / seconds if seconds else None,
+            'entries': count,
+            'peak_bytes': peak,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """the benchmarks which regressed against the baseline
+
+    Returns:
+        a list of (name, metric, ratio) tuples
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            if before[metric] and result[metric] / before[metric] > 1 + tolerance:
+                regressions.append((name, metric, result[metric] / before[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parse = ArgumentParser(description='benchmark cap')
+    parse.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+            help=f'how many entries the lists have, up to {SIZES[-1]}')
+    parse.add_argument('--types', nargs='+', default=list(GENERATORS), choices=list(GENERATORS))
+    parse.add_argument('--only', nargs='+', default=['*'], help='glob patterns of benchmarks to run')
+    parse.add_argument('--repeat', type=int, default=3, help='the best of how many runs is reported')
+    parse.add_argument('--output', help='where to write the results, defaults to stdout')
+    parse.add_argument('--baseline', help='results to compare against')
+    parse.add_argument('--tolerance', type=float, default=0.25,
+            help='how much slower or larger than the baseline is a regression')
+    parse.add_argument('--save', help='also write the results here, as the next baseline')
+    parse.add_argument('--workdir', help='the scratch directory, defaults to a temporary one')
+    args = parse.parse_args(argv)
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='capbench'))
+    (workdir/'.cap'/'plugins').mkdir(parents=True, exist_ok=True)
+    for plugin in PLUGINS.glob('*.py'):
+        shutil.copy(plugin, workdir/'.cap'/'plugins')
+    # cap finds ~/.cap when it is imported, so only import it from here on
+    os.environ['HOME'] = str(workdir)
+
+    results = {}
+    try:
+        for typename in args.types:
+            for size in args.sizes:
+                fixture = Fixture(workdir, typename, size)
+                for name, setup in benchmarks:
+                    if not any(fnmatch(name, pattern) for pattern in args.only):
+                        continue
+                    result = measure(setup, fixture, args.repeat)
+                    if result is not None:
+                        results[f'{name}/{typename}/{size}'] = result
+                        print(f'{name}/{typename}/{size}: {result["seconds"]:.6f}s', file=sys.stderr)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = json.dumps({
+            'meta': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.time(),
+            },
+            'results': results,
+    }, indent=2)
+    if args.output:
+        Path(args.output).write_text(report)
+    else:
+        print(report)
+    if args.save:
+        Path(args.save).write_text(report)
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, ratio in regressions:
+            print(f'regression: {name} {metric} is {ratio:.2f}x the baseline', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,5 @@
+"""a template type for the benchmarks, installed as a plugin so that the
+lists and servers can find it by name like any other plugin type"""
+from cap.store.textobjects import createtxtobj
+
+Task = createtxtobj('Task', "TASK {priority:'[0-9]'} $title")
@@ -1,2 +1,10 @@
-from cap.lists.lists import main_list_set as collections
-from cap.plugins import textobjecttypes
+def __getattr__(name):
+    """import the list set and plugins on first use, so that importing
+    cap (or any of its modules) stays cheap"""
+    if name in ('collections', 'listset'):
+        from cap.lists.lists import main_list_set
+        return main_list_set
+    if name == 'textobjecttypes':
+        from cap.plugins import textobjecttypes
+        return textobjecttypes
+    raise AttributeError(f"module 'cap' has no attribute {name!r}")
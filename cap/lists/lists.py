@@ -1,29 +1,91 @@
 from cap.plugins import textobjecttypes
 from cap.store.textobjectfiles import TextObjectFileGroup, TextObjectFile
+from cap.store.search import SearchIndex, tokens
+from cap.store.parsecache import parse_cache
+from cap.store.backends import open_textobjectfile, suffix, DEFAULT_BACKEND
 from cap.store.textobjects import TextObject
+from cap.utils import filesignature
+from cap.paths import LIST_INDEX_PATH, LIST_PATH, SEARCH_INDEX_PATH
+from cap.metrics import timing, count
 from pathlib import Path
 from functools import wraps
+from itertools import islice
 import cap.plugins as plugins
 
-LIST_INDEX_PATH = Path('~/.cap/list_index.txt').expanduser()
-LIST_PATH = Path('~/.cap/lists').expanduser()
+CONVERT_CHUNK = 10_000
+
 
 class ListSet:
-    def __init__(self, index_path, list_dir):
-        self.index = TextObjectFileGroup(index_path)
+    """The lists, registered in an index file
+
+    Args:
+        index_path (:obj: pathlib.Path): the index of the lists
+        list_dir (:obj: pathlib.Path): where the lists are stored
+        indexed_attributes (iterable): attributes to keep an attribute index
+            of in every list, for `query`, see `TextObjectFile.index_attribute`
+
+    The other arguments are passed to the lists, see `TextObjectFile`
+    """
+    def __init__(self, index_path, list_dir, search_index=None, tombstones=False, snapshot=False,
+            cache=None, index=False, indexed_attributes=()):
+        self.index = TextObjectFileGroup(index_path, cache=cache, search_index=search_index,
+                tombstones=tombstones, snapshot=snapshot, index=index)
         self.list_dir = list_dir
+        self.search_index = search_index
+        self.indexed_attributes = set(indexed_attributes)
+        self._files = None
+        self._signature = None
 
     def __len__(self):
-        return len(self.index)
+        return len(self.by_name())
     
     def __getitem__(self, key):
-        return self.index[key]
+        with timing('listset.lookup', list=key):
+            return self.by_name()[key]
+
+    def add(self, list_name, textobjtype, backend=DEFAULT_BACKEND):
+        """create a list
+
+        Args:
+            list_name (str): the name of the list
+            textobjtype (class, str): the TextObject type the list holds
+            backend (str): how the list is stored, one of
+                `cap.store.backends.backends` such as 'text', 'sqlite' or 'segmented'
+        """
+        with timing('listset.add', list=list_name):
+            path = self.list_dir/f'{list_name}{suffix(backend)}'
+            self.index.add(open_textobjectfile(path, textobjtype))
+            self._signature = None
 
-    def add(self, list_name, textobjtype):
-        self.index.add(TextObjectFile(self.list_dir/f'{list_name}.txt', textobjtype)) 
+    def convert(self, list_name, backend):
+        """move a list to another backend, keeping its entries in order
+
+        Args:
+            list_name (str): the list to move
+            backend (str): the backend to move it to
+        """
+        old = self[list_name]
+        if old.backend == backend:
+            return
+        new = open_textobjectfile(self.list_dir/f'{list_name}{suffix(backend)}', old.textobjectcls)
+        entries = old.entries(lazy=True)
+        while chunk := list(islice(entries, CONVERT_CHUNK)):
+            # the empty match at the end of a text file is not an entry
+            new.add(*(text for text in (str(entry).strip() for entry in chunk) if text))
+        self.index.add(new)
+        self.index.remove(old)
+        old.delete()
+        self._forget(list_name)
+        if self.search_index is not None:
+            self.search_index.forget(old.path)
 
     def remove(self, list_name):
-        self.index.remove(self[list_name])
+        with timing('listset.remove', list=list_name):
+            tof = self[list_name]
+            self.index.remove(tof)
+            self._forget(list_name)
+            if self.search_index is not None:
+                self.search_index.forget(tof.path)
 
     def __add__(self, other):
         self.add(*other)
@@ -34,17 +96,112 @@ class ListSet:
         return self
 
     def __delitem__(self, key):
-        tof = self[key]
-        self.index.delete(tof)
+        with timing('listset.delete', list=key):
+            tof = self[key]
+            self.index.delete(tof)
+            self._forget(key)
+            if self.search_index is not None:
+                self.search_index.forget(tof.path)
     
     def __iter__(self):
-        return iter(self.index)
+        return iter(self.by_name().values())
 
     def by_name(self):
-        return self.index.files_by_name()
+        """the lists in the set by name. the mapping is kept in memory and
+        only rebuilt when the index file changes, so looking up a list
+        does not read the index. a rebuild keeps the TextObjectFiles of the
+        lists which are unchanged, with their caches and attribute indexes
+
+        Returns:
+            a dict of list names to TextObjectFiles
+        """
+        signature = filesignature(self.index.file.path)
+        if self._files is None or self._signature != signature:
+            count('cache_requests', cache='lists', result='miss')
+            files, kept = self.index.files_by_name(), self._files or {}
+            for name, tof in files.items():
+                old = kept.get(name)
+                if old is not None and old.path == tof.path and old.textobjectcls is tof.textobjectcls:
+                    files[name] = old
+                    continue
+                for attribute in self.indexed_attributes:
+                    tof.index_attribute(attribute)
+            self._files, self._signature = files, signature
+        else:
+            count('cache_requests', cache='lists', result='hit')
+        return self._files
+
+    def _forget(self, list_name):
+        """drop a list which was removed, and read the index again on the
+        next lookup"""
+        if self._files is not None:
+            self._files.pop(list_name, None)
+        self._signature = None
+
+    def index_attribute(self, attribute):
+        """keep an attribute index by `attribute` in every list, see
+        `TextObjectFile.index_attribute`"""
+        self.indexed_attributes.add(attribute)
+        for tof in self.by_name().values():
+            tof.index_attribute(attribute)
     
     def __contains__(self, item):
-        return item in self.index
+        return str(item) in self.by_name() or item in self.index.file
+
+    def compact(self, threshold=None, lists=None):
+        """drop the entries removed with tombstones from the lists, see
+        `TextObjectFile.compact`
+
+        Args:
+            threshold (float): only compact lists which are at least this
+                fraction dead entries
+            lists (iterable): the names of the lists to compact, defaults to all
+
+        Returns:
+            the names of the lists which were compacted
+        """
+        files = self.by_name()
+        return [name for name in (files if lists is None else lists) if files[name].compact(threshold)]
+
+    def query(self, *predicates, lists=None, **conditions):
+        """the entries of the lists which satisfy the conditions, see
+        `TextObjectFile.query`. the attribute indexes of `indexed_attributes`
+        answer equality and prefix conditions, and are kept between queries
+
+        Args:
+            lists (iterable): the names of the lists to query, defaults to all
+
+        Returns:
+            a list of (list name, entry) tuples
+        """
+        files = self.by_name()
+        names = files if lists is None else lists
+        return [(name, entry) for name in names
+                for entry in files[name].query(*predicates, **conditions)]
+
+    def search(self, terms, lists=None):
+        """find the entries which contain every word in `terms`, using the
+        search index for the plain text lists if the set has one and
+        otherwise reading the lists
+
+        Args:
+            terms (str): the words to search for
+            lists (iterable): the names of the lists to search, defaults to all
+
+        Returns:
+            a list of (list name, entry) tuples
+        """
+        files = self.by_name()
+        names = {files[name].path: name for name in (files if lists is None else lists)}
+        found, scanned = [], list(names.values())
+        if self.search_index is not None:
+            scanned = [name for name in scanned if files[name].backend != 'text']
+            found = [(names[tof.path], entry) for tof, entry in self.search_index.search(
+                terms, [files[name] for name in names.values() if files[name].backend == 'text'])]
+        words = tokens(terms)
+        return found + [(name, entry) for name in scanned for entry in files[name].entries(lazy=True)
+                if words and words <= tokens(str(entry))]
 
-main_list_set = ListSet(LIST_INDEX_PATH, LIST_PATH)
+main_list_set = ListSet(LIST_INDEX_PATH, LIST_PATH, SearchIndex(SEARCH_INDEX_PATH), tombstones=True,
+        snapshot=True, cache=parse_cache, index=True, indexed_attributes=('item',))
 
@@ -0,0 +1,52 @@
+"""A cache of the names of the lists and of the TextObject types
+
+Commands like `capcli` need the names to build their arguments before they
+know whether they will touch a list at all. The cache is only used while
+the list index and the plugins are unchanged, checked with a few stats,
+so the lists, the store and the plugins are not imported to get them.
+"""
+from cap.paths import LIST_INDEX_PATH, PLUGINS_DIR, NAMES_CACHE_PATH
+import json
+import os
+
+
+def _signature():
+    """the state of the list index and the plugins the names depend on"""
+    files = [LIST_INDEX_PATH, *sorted(PLUGINS_DIR.glob('*.py'))]
+    signature = []
+    for path in files:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        signature.append([str(path), st.st_ino, st.st_size, st.st_mtime_ns])
+    return signature
+
+
+def cached_names():
+    """the names of the lists and the TextObject types from the cache
+
+    Returns:
+        a dict with 'lists' and 'types', or None if the cache is stale
+    """
+    try:
+        cached = json.loads(NAMES_CACHE_PATH.read_text())
+    except (OSError, ValueError):
+        return None
+    if cached.get('signature') != _signature():
+        return None
+    return cached
+
+
+def save_names(lists, types):
+    """cache the names of the lists and the TextObject types
+
+    Returns:
+        the cached dict, as `cached_names` would return it
+    """
+    cached = {'signature': _signature(), 'lists': list(lists), 'types': list(types)}
+    NAMES_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    temp = NAMES_CACHE_PATH.with_name(f'{NAMES_CACHE_PATH.name}.tmp')
+    temp.write_text(json.dumps(cached))
+    os.replace(temp, NAMES_CACHE_PATH)
+    return cached
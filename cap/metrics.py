@@ -0,0 +1,212 @@
+"""Timing hooks for the store and the lists, and a collector of metrics
+
+Parsing, reading and every change to a TextObjectFile, TextObjectFileGroup
+or ListSet is timed as an operation, such as `parse.finditer` or
+`textobjectfile.add`, and reported with labels such as the list it was
+on and how many bytes it read or wrote. Caches count their hits and
+misses as events. Anything can subscribe to them, plugins included:
+
+    from cap.metrics import subscribe
+
+    def slow_adds(event):
+        if event.seconds > 0.1:
+            print(f'slow add to {event.labels["list"]}')
+
+    subscribe(slow_adds, 'textobjectfile.add')
+
+`collector` keeps latency histograms, byte counts and event counts for
+the taskservers' /metrics endpoint, in the Prometheus text format.
+"""
+from fnmatch import fnmatch
+from threading import Lock
+import time
+
+# the default buckets of the Prometheus clients, in seconds
+BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5, 5.0, 7.5, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_subscribers = []
+_matching = {}
+
+
+class Event:
+    """something measured
+
+    Attributes:
+        name (str): what happened, such as 'textobjectfile.add'
+        labels (dict): where it happened, such as {'list': 'groceries'}
+        seconds (float): how long an operation took, None for a count
+        bytes (int): how many bytes an operation read or wrote, if known
+    """
+    __slots__ = ('name', 'labels', 'seconds', 'bytes')
+
+    def __init__(self, name, labels, seconds=None, bytes=None):
+        self.name = name
+        self.labels = labels
+        self.seconds = seconds
+        self.bytes = bytes
+
+    def __repr__(self):
+        return f'Event({self.name!r}, {self.labels!r}, seconds={self.seconds}, bytes={self.bytes})'
+
+
+def subscribe(callback, pattern='*'):
+    """call `callback` with every Event whose name matches the glob `pattern`"""
+    _subscribers.append((pattern, callback))
+    _matching.clear()
+
+
+def unsubscribe(callback):
+    _subscribers[:] = [(p, c) for p, c in _subscribers if c != callback]
+    _matching.clear()
+
+
+def emit(event):
+    """pass an Event to its subscribers"""
+    callbacks = _matching.get(event.name)
+    if callbacks is None:
+        callbacks = _matching[event.name] = [callback for pattern, callback in _subscribers
+                if fnmatch(event.name, pattern)]
+    for callback in callbacks:
+        callback(event)
+
+
+def count(name, **labels):
+    """report that something happened, such as a cache hit"""
+    if _subscribers:
+        emit(Event(name, labels))
+
+
+class timing:
+    """time the operation in a `with` block. the Event is reported when
+    the block exits, set `bytes` on it to report what the operation read
+    or wrote
+
+        with timing('textobjectfile.add', list=name) as event:
+            event.bytes = written
+    """
+    __slots__ = ('event', 'start')
+
+    def __init__(self, name, **labels):
+        self.event = Event(name, labels)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.event
+
+    def __exit__(self, *exc_info):
+        self.event.seconds = time.perf_counter() - self.start
+        if _subscribers:
+            emit(self.event)
+
+
+def timed(iterable, name, bytes=None, **labels):
+    """iterate `iterable` timing only the work of producing its items, not
+    what the consumer does between them. the Event is reported when the
+    iteration finishes or is abandoned
+
+        for entry in timed(cls.finditer(buffer), 'parse.finditer', bytes=len(buffer)):
+            ...
+    """
+    if not _subscribers:
+        yield from iterable
+        return
+    event, seconds, iterator = Event(name, labels, bytes=bytes), 0.0, iter(iterable)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - start
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+        event.seconds = seconds
+        emit(event)
+
+
+class Collector:
+    """keeps metrics of the Events it is subscribed to: a histogram of
+    the time taken by each operation, the bytes each read or wrote and a
+    count of other events, all per set of labels"""
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = Lock()
+        self.histograms = {}
+        self.bytes = {}
+        self.counts = {}
+        self.installed = False
+
+    def install(self):
+        """subscribe to every Event, once"""
+        if not self.installed:
+            subscribe(self)
+            self.installed = True
+
+    def __call__(self, event):
+        labels = tuple(sorted((name, str(value)) for name, value in event.labels.items()))
+        key = (event.name, labels)
+        with self.lock:
+            if event.seconds is None:
+                self.counts[key] = self.counts.get(key, 0) + 1
+                return
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = histogram[0]
+            for i, bound in enumerate(self.buckets):
+                if event.seconds <= bound:
+                    counts[i] += 1
+                    break
+            histogram[1] += event.seconds
+            histogram[2] += 1
+            if event.bytes is not None:
+                self.bytes[key] = self.bytes.get(key, 0) + event.bytes
+
+    def render(self):
+        """the metrics in the Prometheus text format"""
+        with self.lock:
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self.histograms.items()}
+            byte_counts = dict(self.bytes)
+            counts = dict(self.counts)
+        lines = []
+        if histograms:
+            lines.append('# HELP cap_operation_seconds time taken by cap operations')
+            lines.append('# TYPE cap_operation_seconds histogram')
+        for (name, labels), (buckets, total, number) in sorted(histograms.items()):
+            labels = (('operation', name),) + labels
+            cumulative = 0
+            for bound, observed in zip(self.buckets, buckets):
+                cumulative += observed
+                lines.append(f'cap_operation_seconds_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'cap_operation_seconds_bucket{_labels(labels + (("le", "+Inf"),))} {number}')
+            lines.append(f'cap_operation_seconds_sum{_labels(labels)} {total}')
+            lines.append(f'cap_operation_seconds_count{_labels(labels)} {number}')
+        if byte_counts:
+            lines.append('# HELP cap_operation_bytes_total bytes read or written by cap operations')
+            lines.append('# TYPE cap_operation_bytes_total counter')
+        for (name, labels), number in sorted(byte_counts.items()):
+            lines.append(f'cap_operation_bytes_total{_labels((("operation", name),) + labels)} {number}')
+        for name in sorted({name for name, _ in counts}):
+            metric = f'cap_{name.replace(".", "_")}_total'
+            lines.append(f'# TYPE {metric} counter')
+            for (counted, labels), number in sorted(counts.items()):
+                if counted == name:
+                    lines.append(f'{metric}{_labels(labels)} {number}')
+        return ''.join(f'{line}\n' for line in lines)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+            for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+collector = Collector()
@@ -0,0 +1,11 @@
+"""Where cap keeps its files. kept free of imports so that commands
+can find them without importing the rest of cap"""
+from pathlib import Path
+
+CAP_DIR = Path('~/.cap').expanduser()
+LIST_INDEX_PATH = CAP_DIR/'list_index.txt'
+LIST_PATH = CAP_DIR/'lists'
+SEARCH_INDEX_PATH = CAP_DIR/'search.sqlite3'
+PLUGINS_DIR = CAP_DIR/'plugins'
+MANIFEST_PATH = PLUGINS_DIR/'.manifest.json'
+NAMES_CACHE_PATH = CAP_DIR/'names.json'
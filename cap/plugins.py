@@ -1,19 +1,106 @@
-from cap.store.textobjects import TextObject, RegexTextObject
+from cap.store.textobjects import TextObject, RegexTextObject, TextObjectRecord
 from cap.utils import subclasses
+from cap.paths import PLUGINS_DIR, MANIFEST_PATH
 from pathlib import Path
 from importlib.machinery import SourceFileLoader
-from pathlib import Path
+from collections.abc import Mapping
+import hashlib
+import json
+import os
 
-PLUGINS_DIR = Path('~/.cap/plugins').expanduser()
 
-def __module(path):
+def _module(path):
     """load a module from the specified path"""
     name = path.with_suffix('').name
     return SourceFileLoader(name, str(path)).load_module()
 
-modules = [__module(p) for p in PLUGINS_DIR.glob('*.py')]
+def _types():
+    return {cls for cls in subclasses(TextObject)
+            if cls not in (TextObject, RegexTextObject, TextObjectRecord)}
+
+
+class TextObjectTypes(Mapping):
+    """The TextObject types by name: the builtin ones and those defined by
+    plugins in `plugins_dir`
+
+    Plugins are only imported when one of their types is first used. Which
+    types each plugin defines is recorded in a manifest, which is trusted
+    for as long as the plugin's mtime and size, or failing those its
+    content hash, are unchanged. A plugin that changed is imported to find
+    its types again.
+
+    Args:
+        plugins_dir (:obj: pathlib.Path): the directory of plugin modules
+        manifest_path (:obj: pathlib.Path): where to keep the manifest
+    """
+    def __init__(self, plugins_dir, manifest_path):
+        self.plugins_dir = plugins_dir
+        self.manifest_path = manifest_path
+        self.builtin = {cls.__name__:cls for cls in _types()}
+        self.loaded = {}
+        self.modules = {}
+        self.defined = {}
+        self._plugins = None
+
+    def plugins(self):
+        """the plugin defining each type, from the manifest
+
+        Returns:
+            a dict of type names to plugin paths
+        """
+        if self._plugins is None:
+            self._plugins = {name:Path(path) for path, record in self._manifest().items()
+                    for name in record['types']}
+        return self._plugins
+
+    def _manifest(self):
+        try:
+            manifest = json.loads(self.manifest_path.read_text())
+        except (OSError, ValueError):
+            manifest = {}
+        fresh, changed = {}, False
+        for path in sorted(self.plugins_dir.glob('*.py')):
+            st = os.stat(path)
+            record = manifest.get(str(path))
+            if record and (record['mtime'], record['size']) == (st.st_mtime_ns, st.st_size):
+                fresh[str(path)] = record
+                continue
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()
+            if not record or record['hash'] != digest:
+                record = {'hash': digest, 'types': list(self._load(path))}
+            fresh[str(path)] = dict(record, mtime=st.st_mtime_ns, size=st.st_size)
+            changed = True
+        if changed or fresh.keys() != manifest.keys():
+            temp = self.manifest_path.with_name(f'{self.manifest_path.name}.tmp')
+            temp.write_text(json.dumps(fresh))
+            os.replace(temp, self.manifest_path)
+        return fresh
+
+    def _load(self, path):
+        """import a plugin, returning the types it defines by name"""
+        if path not in self.modules:
+            before = _types()
+            self.modules[path] = _module(path)
+            self.defined[path] = {cls.__name__:cls for cls in _types() - before}
+            self.loaded.update(self.defined[path])
+        return self.defined[path]
+
+    def __getitem__(self, name):
+        if name in self.loaded:
+            return self.loaded[name]
+        if name in self.builtin:
+            return self.builtin[name]
+        if name in self.plugins():
+            self._load(self.plugins()[name])
+            return self.loaded[name]
+        raise KeyError(name)
+
+    def __iter__(self):
+        return iter({**self.builtin, **self.plugins()})
 
-textobjecttypes = {cls.__name__:cls for cls in subclasses(TextObject) 
-        if cls is not TextObject and cls is not RegexTextObject}
+    def __len__(self):
+        return len({**self.builtin, **self.plugins()})
 
 
+textobjecttypes = TextObjectTypes(PLUGINS_DIR, MANIFEST_PATH)
+modules = textobjecttypes.modules
@@ -0,0 +1,62 @@
+"""Storage backends for TextObjectFiles
+
+A backend is a class with the TextObjectFile API, registered under a
+name and the suffix of the files it stores lists in. The backend of a
+file is chosen by its suffix, so a TextObjectFileGroup (and a ListSet)
+can hold lists in any mix of backends. Files with an unknown suffix are
+plain text.
+
+Backends are given as `module:class` strings and only imported when a
+file of theirs is opened, plugins can register their own:
+
+    register_backend('mine', '.mine', 'myplugin:MyTextObjectFile')
+"""
+from importlib import import_module
+from pathlib import Path
+
+DEFAULT_BACKEND = 'text'
+
+backends = {
+        'text': ('.txt', 'cap.store.textobjectfiles:TextObjectFile'),
+        'sqlite': ('.db', 'cap.store.sqlitefiles:SQLiteTextObjectFile'),
+        'segmented': ('.seg', 'cap.store.segments:SegmentedTextObjectFile'),
+}
+
+
+def register_backend(name, suffix, cls):
+    """register a backend
+
+    Args:
+        name (str): the name to choose the backend by
+        suffix (str): the suffix of the backend's files, such as '.db'
+        cls (class, str): the backend's class, or a `module:class` string
+    """
+    backends[name] = (suffix, cls)
+
+
+def suffix(backend):
+    """the suffix of a backend's files
+
+    Raises:
+        ValueError: for an unknown backend
+    """
+    if backend not in backends:
+        raise ValueError(f'{backend} is not one of {", ".join(backends)}')
+    return backends[backend][0]
+
+
+def backend_class(path):
+    """the class of the backend a file is stored in, by its suffix"""
+    path_suffix = Path(path).suffix
+    cls = next((cls for suffix, cls in backends.values() if suffix == path_suffix),
+            backends[DEFAULT_BACKEND][1])
+    if isinstance(cls, str):
+        module, _, name = cls.partition(':')
+        cls = getattr(import_module(module), name)
+    return cls
+
+
+def open_textobjectfile(path, textobjectcls, **options):
+    """open a file with the backend its suffix belongs to. options the
+    backend doesn't use, such as a text file's `index`, are ignored by it"""
+    return backend_class(path)(path, textobjectcls, **options)
@@ -0,0 +1,120 @@
+from array import array
+from pathlib import Path
+from cap.utils import mapped
+import os
+import struct
+
+MAGIC = b'CAPIDX1\n'
+HEADER = struct.Struct('<8sQQ')
+SPAN_SIZE = array('Q').itemsize * 2
+
+
+class OffsetIndex:
+    """A sidecar to a TextObjectFile which stores the byte offset and
+    length of every entry in the file, so that entries can be counted and
+    read by position without parsing the whole file
+
+    The sidecar is kept next to the file as `.<name>.idx`. It records the
+    size and mtime of the file it was built from and is rebuilt whenever
+    they no longer match.
+
+    Args:
+        path (:obj: pathlib.Path): the path to the indexed file
+        textobjectcls (class): the RegexTextObject stored in the file
+    """
+    def __init__(self, path, textobjectcls):
+        self.textpath = Path(path)
+        self.path = self.textpath.with_name(f'.{self.textpath.name}.idx')
+        self.textobjectcls = textobjectcls
+        self.spans = None
+        self.signature = None
+
+    def stat(self):
+        """the (size, mtime) of the indexed file"""
+        st = os.stat(self.textpath)
+        return st.st_size, st.st_mtime_ns
+
+    def load(self):
+        """load the index, reading the sidecar or rebuilding it if
+        it is missing or stale
+
+        Returns:
+            a flat `array('Q')` of (offset, length) pairs
+        """
+        signature = self.stat()
+        if self.spans is not None and self.signature == signature:
+            return self.spans
+        if not self._read(signature):
+            self.build(signature)
+        return self.spans
+
+    def _read(self, signature):
+        try:
+            with self.path.open('rb') as f:
+                magic, *header = HEADER.unpack(f.read(HEADER.size))
+                if magic != MAGIC or tuple(header) != signature:
+                    return False
+                spans = array('Q')
+                spans.frombytes(f.read())
+        except (OSError, struct.error):
+            return False
+        self.spans, self.signature = spans, signature
+        return True
+
+    def build(self, signature=None):
+        """parse the whole file and write a fresh sidecar"""
+        self.spans, self.signature = self._scan(0), signature or self.stat()
+        with self.path.open('wb') as f:
+            f.write(HEADER.pack(MAGIC, *self.signature))
+            self.spans.tofile(f)
+
+    def _scan(self, start):
+        spans = array('Q')
+        with mapped(self.textpath) as buffer:
+            for match in self.textobjectcls.matches(buffer, start):
+                begin, end = match.span()
+                spans.extend((begin, end - begin))
+        return spans
+
+    def appended(self, signature):
+        """bring the index up to date after entries were appended to the file
+
+        Only the tail of the file is parsed, starting from the last indexed
+        entry since an append can extend it. If the index was not fresh
+        for `signature` it is left to be rebuilt on the next load.
+
+        Args:
+            signature (tuple): the (size, mtime) of the file before the append
+        """
+        if self.spans is None or self.signature != signature:
+            return
+        keep = max(len(self.spans) // 2 - 1, 0)
+        start = self.spans[keep * 2] if self.spans else 0
+        tail = self._scan(start)
+        del self.spans[keep * 2:]
+        self.spans.extend(tail)
+        self.signature = self.stat()
+        with self.path.open('r+b') as f:
+            f.truncate(HEADER.size + keep * SPAN_SIZE)
+            f.seek(0, 2)
+            tail.tofile(f)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, *self.signature))
+
+    def invalidate(self):
+        """drop the index after the file was rewritten"""
+        self.spans = self.signature = None
+        if self.path.exists():
+            self.path.unlink()
+
+    def __len__(self):
+        return len(self.load()) // 2
+
+    def __getitem__(self, key):
+        """the (offset, length) of the entry at `key`, or a list of them
+        if `key` is a slice"""
+        spans = self.load()
+        positions = range(len(spans) // 2)[key]
+        if isinstance(key, slice):
+            return [(spans[i * 2], spans[i * 2 + 1]) for i in positions]
+        return spans[positions * 2], spans[positions * 2 + 1]
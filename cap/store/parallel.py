@@ -0,0 +1,207 @@
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from itertools import chain
+from cap.store.textobjects import SpanMatch, bytes_regex, prefilter, prefiltered_finditer
+from cap.utils import mapped
+
+# files are parsed in chunks of about this many bytes, one per worker
+PARSE_CHUNK = 1 << 24
+
+
+def boundaries(path, size=PARSE_CHUNK):
+    """split a file into ranges of about `size` bytes which start at line
+    boundaries, so that entries are rarely split between two ranges
+
+    Args:
+        path (:obj: pathlib.Path): the file to split
+        size (int): how many bytes each range should hold
+
+    Returns:
+        a list of (start, end) byte offsets, covering the whole file
+    """
+    with mapped(path) as buffer:
+        starts, length = [0], len(buffer)
+        while starts[-1] + size < length:
+            newline = buffer.find(b'\n', starts[-1] + size)
+            if newline < 0 or newline + 1 == length:
+                break
+            starts.append(newline + 1)
+    return list(zip(starts, starts[1:] + [length]))
+
+
+def spans(path, regex, start=0, end=None):
+    """the offsets of every entry which starts between `start` and `end`,
+    run in a worker process so that only the compact offsets are sent
+    back. an entry may run on past `end`
+
+    Args:
+        path (:obj: pathlib.Path): the file to parse
+        regex (:obj: re.Pattern): the regex of the RegexTextObject stored in
+            the file. types made with `createtxtobj` can't be pickled, so
+            workers are sent their regex instead
+        start (int): where to start searching
+        end (int): where to stop, defaults to the end of the file
+
+    Returns:
+        a flat `array('q')` with the start and end of each entry and of
+        each of its groups, see `SpanMatch`
+    """
+    found = array('q')
+    with mapped(path) as buffer:
+        end = len(buffer) if end is None else end
+        for match in prefiltered_finditer(bytes_regex(regex), buffer, start, prefilter(regex)):
+            if _past(match, end, len(buffer)):
+                break
+            found.extend(chain.from_iterable(match.regs))
+    return found
+
+
+def merge(path, textobjectcls, chunks):
+    """join the offsets found in consecutive chunks of a file into those a
+    single search of the whole file finds
+
+    A chunk's entries are the same as the single search's unless the
+    entry before the chunk runs on into it. Then the file is searched
+    again from the end of that entry until a match lines up with one the
+    chunk found.
+
+    Args:
+        path (:obj: pathlib.Path): the parsed file
+        textobjectcls (class): the RegexTextObject stored in the file
+        chunks (iterable): (start, end, offsets) for each chunk in order,
+            the offsets as returned by `spans`
+
+    Returns:
+        a flat `array('q')` of offsets for the whole file
+    """
+    width = 2 * (textobjectcls.regex.groups + 1)
+    merged, position = array('q'), 0
+    for start, end, offsets in chunks:
+        if position > start:
+            starts = {offsets[i]: i for i in range(0, len(offsets), width)}
+            with mapped(path) as buffer:
+                for match in textobjectcls.matches(buffer, position):
+                    if _past(match, end, len(buffer)):
+                        offsets = array('q')
+                        break
+                    if match.start() in starts:
+                        offsets = offsets[starts[match.start()]:]
+                        break
+                    merged.extend(chain.from_iterable(match.regs))
+                    position = match.end()
+                else:
+                    offsets = array('q')
+        merged.extend(offsets)
+        if len(merged):
+            position = max(position, merged[-width + 1])
+    return merged
+
+
+def _past(match, end, length):
+    """whether a match starts after the chunk ending at `end`. the last
+    chunk takes a match at the very end of the file, which can be empty"""
+    return match.start() >= end and end < length
+
+
+def from_offsets(buffer, textobjectcls, offsets):
+    """create the entries at the given offsets, without searching
+
+    Args:
+        buffer (:obj: mmap.mmap): the contents of the file
+        textobjectcls (class): the RegexTextObject stored in the file
+        offsets (:obj: array): offsets as returned by `spans`
+
+    Returns:
+        a list of `textobjectcls` instances
+    """
+    width = 2 * (textobjectcls.regex.groups + 1)
+    groupindex = textobjectcls.regex.groupindex
+    return [textobjectcls._from_match(SpanMatch(buffer, offsets[i:i + width].tolist(), groupindex))
+            for i in range(0, len(offsets), width)]
+
+
+def parse(path, textobjectcls, workers=None, size=PARSE_CHUNK):
+    """parse one file in a process pool, a chunk per worker, for large
+    files of types whose regexes are expensive
+
+    Args:
+        path (:obj: pathlib.Path): the file to parse
+        textobjectcls (class): the RegexTextObject stored in the file
+        workers (int): how many processes to use, defaults to one per cpu
+        size (int): about how many bytes to give each worker at a time
+
+    Returns:
+        a list of `textobjectcls` instances, in the order of the file
+    """
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [(start, end, pool.submit(spans, path, textobjectcls.regex, start, end))
+                for start, end in boundaries(path, size)]
+        offsets = merge(path, textobjectcls, ((start, end, future.result())
+            for start, end, future in futures))
+    with mapped(path) as buffer:
+        return from_offsets(buffer, textobjectcls, offsets)
+
+
+def read_files(textobjectfiles, ordered=True, workers=None, processes=False):
+    """read and parse several TextObjectFiles concurrently
+
+    Args:
+        textobjectfiles (iterable): the TextObjectFiles to read
+        ordered (bool): yield the files in the order given, otherwise
+            yield each file as soon as it has been read
+        workers (int): how many files to read at once, defaults to the
+            executor's default
+        processes (bool): parse the files in a process pool rather than
+            threads, for types whose regexes are expensive. large files
+            are split into chunks parsed by several workers. the workers
+            return the offsets of the entries and their groups, from
+            which the entries are created in this process without
+            searching. files which aren't plain text are still read in
+            threads
+
+    Yields:
+        (TextObjectFile, list of entries) tuples
+    """
+    textobjectfiles = list(textobjectfiles)
+    processpool = ProcessPoolExecutor(workers) if processes else nullcontext()
+    with processpool as pool, ThreadPoolExecutor(workers) as threads:
+        futures = {}
+        for tof in textobjectfiles:
+            if processes and tof.backend == 'text':
+                futures[tof] = [(start, end, pool.submit(spans, tof.path, tof.textobjectcls.regex, start, end))
+                        for start, end in boundaries(tof.path)]
+            else:
+                futures[tof] = threads.submit(_entries, tof)
+        if ordered:
+            done = iter(textobjectfiles)
+        else:
+            done = _completed(futures)
+        for tof in done:
+            found = futures[tof]
+            if isinstance(found, list):
+                offsets = merge(tof.path, tof.textobjectcls,
+                        ((start, end, future.result()) for start, end, future in found))
+                with mapped(tof.path) as buffer:
+                    yield tof, list(tof._live(from_offsets(buffer, tof.textobjectcls, offsets)))
+            else:
+                yield tof, found.result()
+
+
+def _completed(futures):
+    """the files in the order their futures complete"""
+    waiting = {}
+    for tof, found in futures.items():
+        for future in ([future for *_, future in found] if isinstance(found, list) else [found]):
+            waiting[future] = tof
+    remaining = Counter(waiting.values())
+    for future in as_completed(waiting):
+        tof = waiting[future]
+        remaining[tof] -= 1
+        if not remaining[tof]:
+            yield tof
+
+
+def _entries(textobjectfile):
+    return list(textobjectfile.entries())
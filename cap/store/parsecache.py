@@ -0,0 +1,114 @@
+from collections import OrderedDict
+from threading import Lock
+from cap.utils import mapped, filesignature
+from cap.metrics import count
+
+GUARD_SIZE = 64
+# how many entries the cache holds across every file before the least
+# recently read files are dropped
+MAX_ENTRIES = 1 << 21
+
+
+class CachedParse:
+    """the parsed entries of one file and the point the parse reached"""
+    def __init__(self, entries, resume, signature, guard):
+        self.entries = entries
+        self.resume = resume
+        self.signature = signature
+        self.guard = guard
+
+
+class ParseCache:
+    """A cache of parsed TextObjectFiles shared by every TextObjectFile
+    opened with it, keyed on the resolved path and TextObject type
+
+    When a file has only grown since it was last parsed just the new
+    tail is parsed. A file which shrank, was replaced (a new inode) or
+    changed without growing is parsed again in full, as is one where the
+    bytes before the resume point no longer match.
+
+    A file is parsed by one thread at a time. The cached list is never
+    changed once returned, a partial parse builds a new list, so callers
+    may keep iterating the entries they were given.
+
+    Args:
+        max_entries (int): how many entries to hold in total. once there
+            are more the least recently read files are dropped, the file
+            just read is always kept
+    """
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.parses = OrderedDict()
+        self.locks = {}
+        self.lock = Lock()
+        self.max_entries = max_entries
+        self.size = 0
+
+    def entries(self, path, textobjectcls, snapshot=None):
+        """the entries of the file, parsing only what changed since the
+        last call
+
+        Args:
+            path (:obj: pathlib.Path): the file to read
+            textobjectcls (class): the RegexTextObject stored in the file
+            snapshot (:obj: Snapshot): the file's snapshot, which a full
+                parse is loaded from instead
+
+        Returns:
+            a list of `textobjectcls` instances
+        """
+        key = (path.resolve(), textobjectcls)
+        with self.lock:
+            lock = self.locks.setdefault(key, Lock())
+        with lock:
+            signature = filesignature(path)
+            cached = self.parses.get(key)
+            if cached and cached.signature == signature:
+                count('cache_requests', cache='parse', result='hit')
+                with self.lock:
+                    if key in self.parses:
+                        self.parses.move_to_end(key)
+                return cached.entries
+            with mapped(path) as buffer:
+                if cached and self._grew(cached, signature, buffer):
+                    count('cache_requests', cache='parse', result='partial')
+                    # the last entry is parsed again as it may have grown
+                    entries = cached.entries[:-1]
+                    entries.extend(textobjectcls.finditer(buffer, cached.resume))
+                else:
+                    count('cache_requests', cache='parse', result='miss')
+                    if snapshot is not None:
+                        entries = list(snapshot.entries())
+                    else:
+                        entries = list(textobjectcls.finditer(buffer))
+                resume = entries[-1].span()[0] if entries else 0
+                guard = buffer[max(resume - GUARD_SIZE, 0):resume]
+            with self.lock:
+                self._forget(key)
+                self.parses[key] = CachedParse(entries, resume, signature, guard)
+                self.size += len(entries)
+                while self.size > self.max_entries and len(self.parses) > 1:
+                    self._forget(next(iter(self.parses)))
+                    count('cache_evictions', cache='parse')
+            return entries
+
+    def _forget(self, key):
+        cached = self.parses.pop(key, None)
+        if cached is not None:
+            self.size -= len(cached.entries)
+
+    @staticmethod
+    def _grew(cached, signature, buffer):
+        ino, size, _ = signature
+        cached_ino, cached_size, _ = cached.signature
+        return (ino == cached_ino and size > cached_size
+                and buffer[max(cached.resume - GUARD_SIZE, 0):cached.resume] == cached.guard)
+
+    def invalidate(self, path):
+        """forget every parse of the file at `path`"""
+        path = path.resolve()
+        with self.lock:
+            for key in [key for key in self.parses if key[0] == path]:
+                self._forget(key)
+
+
+parse_cache = ParseCache()
@@ -0,0 +1,199 @@
+"""Query the entries of TextObjectFiles by their named group attributes
+
+Conditions are given as keyword arguments in the form `attribute=value`,
+`attribute__prefix=value` or `attribute__regex=pattern`. Attribute values
+are compared as strings, so transformed attributes such as paths work too.
+"""
+from bisect import bisect_left, insort
+from operator import itemgetter
+import re
+
+
+class Predicate:
+    """a condition on an attribute of a text object. entries without the
+    attribute never match"""
+    def __init__(self, attribute, value):
+        self.attribute = attribute
+        self.value = value
+
+    def __call__(self, entry):
+        value = getattr(entry, self.attribute, None)
+        return value is not None and self.test(str(value))
+
+    def lookup(self, index):
+        """the candidate entries from an AttributeIndex, or None if the
+        index cannot answer this predicate"""
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.attribute!r}, {self.value!r})'
+
+
+class Equals(Predicate):
+    def test(self, value):
+        return value == self.value
+
+    def lookup(self, index):
+        return index.equal(self.value)
+
+
+class Prefix(Predicate):
+    def test(self, value):
+        return value.startswith(self.value)
+
+    def lookup(self, index):
+        return index.prefixed(self.value)
+
+
+class Regex(Predicate):
+    def __init__(self, attribute, value):
+        super().__init__(attribute, re.compile(value))
+
+    def test(self, value):
+        return self.value.search(value) is not None
+
+
+LOOKUPS = {'eq': Equals, 'prefix': Prefix, 'regex': Regex}
+
+
+def parse_conditions(*predicates, **conditions):
+    """combine predicates with predicates built from keyword conditions
+
+    Raises:
+        ValueError: for an unknown lookup such as `item__like`
+    """
+    parsed = list(predicates)
+    for condition, value in conditions.items():
+        attribute, _, lookup = condition.partition('__')
+        if (lookup or 'eq') not in LOOKUPS:
+            raise ValueError(f'{lookup} is not one of {", ".join(LOOKUPS)}')
+        parsed.append(LOOKUPS[lookup or 'eq'](attribute, value))
+    return parsed
+
+
+def select(entries, predicates):
+    """the entries which satisfy every predicate"""
+    return [entry for entry in entries if all(predicate(entry) for predicate in predicates)]
+
+
+class AttributeIndex:
+    """A secondary index of the entries of a TextObjectFile by the value
+    of one attribute, answering equality and prefix predicates without
+    a scan. kept fresh by the TextObjectFile it belongs to, which passes
+    on its adds, removes and replaces. lookups return entries in the order
+    of the file
+
+    Args:
+        attribute (str): the attribute to index
+    """
+    def __init__(self, attribute):
+        self.attribute = attribute
+        self.entries = None
+        self.values = None
+        self.keys = None
+        self.signature = None
+        self.added = 0
+
+    def build(self, entries, signature):
+        self.entries, self.values, self.keys, self.signature, self.added = {}, [], {}, signature, 0
+        self.add(entries)
+
+    def add(self, entries):
+        """index entries which come after those already indexed. the new
+        values are sorted in once, rather than inserted one at a time"""
+        new = []
+        for position, entry in enumerate(entries, self.added):
+            self.added = position + 1
+            value = getattr(entry, self.attribute, None)
+            if value is None:
+                continue
+            value = str(value)
+            if value not in self.entries:
+                self.entries[value] = []
+                new.append(value)
+            self.entries[value].append((position, entry))
+            self.keys[str(entry).strip()] = value
+        if new:
+            self.values.extend(new)
+            self.values.sort()
+
+    def remove(self, keys):
+        """drop every entry with one of the keys, their text without
+        surrounding whitespace"""
+        for key in keys:
+            value = self.keys.pop(key, None)
+            if value is None:
+                continue
+            kept = [(position, entry) for position, entry in self.entries[value]
+                    if str(entry).strip() != key]
+            if kept:
+                self.entries[value] = kept
+            else:
+                del self.entries[value]
+                del self.values[bisect_left(self.values, value)]
+
+    def replace(self, replacements, create):
+        """replace every entry with one of the keys by its replacement, in
+        the same position
+
+        Args:
+            replacements (dict): maps keys to the text of their replacements
+            create (function): makes an entry from text
+
+        Returns:
+            False if an entry without the attribute was replaced by one with
+            it, which the index doesn't know the position of
+        """
+        for key, new_key in replacements.items():
+            value = self.keys.get(key)
+            positions = [position for position, entry in self.entries.get(value, ())
+                    if str(entry).strip() == key]
+            self.remove([key])
+            entry = create(new_key)
+            new_value = getattr(entry, self.attribute, None)
+            if new_value is None:
+                continue
+            if not positions:
+                return False
+            new_value = str(new_value)
+            if new_value not in self.entries:
+                self.entries[new_value] = []
+                insort(self.values, new_value)
+            indexed = self.entries[new_value]
+            for position in positions:
+                indexed.insert(bisect_left([p for p, _ in indexed], position), (position, entry))
+            self.keys[new_key] = new_value
+        return True
+
+    def changed(self, operations, create):
+        """update the index after adds, removes and replaces
+
+        Args:
+            operations (list): (operation, items) pairs as `TextObjectFile.apply`
+                takes them, with each item's text without surrounding whitespace
+            create (function): makes an entry from text
+
+        Returns:
+            False if the index could not be updated and has to be built again
+        """
+        for operation, items in operations:
+            if operation == 'add':
+                self.add([create(item) for item in items])
+            elif operation == 'remove':
+                self.remove(items)
+            elif not self.replace(items, create):
+                return False
+        return True
+
+    def invalidate(self):
+        self.entries = self.values = self.keys = self.signature = None
+
+    def equal(self, value):
+        return [entry for _, entry in self.entries.get(value, ())]
+
+    def prefixed(self, prefix):
+        found, i = [], bisect_left(self.values, prefix)
+        while i < len(self.values) and self.values[i].startswith(prefix):
+            found.extend(self.entries[self.values[i]])
+            i += 1
+        found.sort(key=itemgetter(0))
+        return [entry for _, entry in found]
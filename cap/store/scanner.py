@@ -0,0 +1,80 @@
+from itertools import chain
+from cap.store.textobjects import SpanMatch
+from cap.utils import mapped
+import re
+
+INLINE_FLAGS = {re.IGNORECASE: 'i', re.MULTILINE: 'm', re.DOTALL: 's', re.VERBOSE: 'x'}
+GROUP_NAME = re.compile(r'\(\?P([<=])(\w+)')
+GLOBAL_FLAGS = re.compile(r'^\(\?[aiLmsux]+\)')
+
+
+class Scanner:
+    """Finds the occurances of several RegexTextObject types in a single
+    pass over some text, yielding them in the order they appear
+
+    The regexes of the types are combined into one alternation with a named
+    group per type, each match is dispatched to the type whose group matched
+    and the object is made from that type's groups within the same match.
+    Where more than one type matches at the same position the type given
+    first wins, so put more general types such as `Line` last. Numbered
+    backreferences are not supported as the groups are renumbered.
+
+    Args:
+        *textobjectclasses (class): the RegexTextObject types to scan for
+    """
+    def __init__(self, *textobjectclasses):
+        self.textobjectclasses = textobjectclasses
+        self.regex = re.compile('|'.join(_alternative(i, cls)
+            for i, cls in enumerate(textobjectclasses)))
+        # where each type's groups are in the combined regex, its own groups
+        # follow the group named for the type in order
+        self.groups = [(self.regex.groupindex[f'_{i}'], cls.regex.groups)
+                for i, cls in enumerate(textobjectclasses)]
+        self._bytesregex = None
+
+    def bytesregex(self):
+        """the combined regex compiled for bytes, compiled on first use"""
+        if self._bytesregex is None:
+            self._bytesregex = re.compile(self.regex.pattern.encode())
+        return self._bytesregex
+
+    def finditer(self, text, pos=0):
+        """find the occurances of every type in the text
+
+        Args:
+            text (str, bytes, mmap.mmap): the text to scan
+            pos (int): where in the text to start
+
+        Yields:
+            instances of the scanned types, in the order they appear
+        """
+        regex = self.regex if isinstance(text, str) else self.bytesregex()
+        for match in regex.finditer(text, pos):
+            i = int(match.lastgroup[1:])
+            cls, (first, groups) = self.textobjectclasses[i], self.groups[i]
+            row = list(chain.from_iterable(match.regs[first:first + groups + 1]))
+            yield cls._from_match(SpanMatch(text, row, cls.regex.groupindex))
+
+    def entries(self, path):
+        """scan a file, which is memory mapped rather than read into memory
+
+        Args:
+            path (:obj: pathlib.Path): the file to scan
+
+        Yields:
+            instances of the scanned types, in the order they appear
+        """
+        with mapped(path) as buffer:
+            yield from self.finditer(buffer)
+
+
+def _alternative(i, cls):
+    """the regex of `cls` as a named group of the combined regex, with its
+    own groups renamed so they cannot clash with another type's and its
+    flags scoped to the group"""
+    pattern = GLOBAL_FLAGS.sub('', cls.regex.pattern)
+    pattern = GROUP_NAME.sub(lambda m: f'(?P{m.group(1)}_{i}_{m.group(2)}', pattern)
+    on = ''.join(c for flag, c in INLINE_FLAGS.items() if cls.regex.flags & flag)
+    off = ''.join(c for flag, c in INLINE_FLAGS.items() if not cls.regex.flags & flag and c != 'x')
+    flags = f'{on}-{off}' if off else on
+    return f'(?P<_{i}>(?{flags}:{pattern}))'
@@ -0,0 +1,200 @@
+from cap.utils import mapped, filesignature
+from threading import Lock
+import sqlite3
+import re
+
+TOKEN = re.compile(r'\w+')
+# bumped whenever the tables change, an index built with another version
+# is dropped and rebuilt as the files are searched
+SCHEMA_VERSION = 1
+
+
+def tokens(text):
+    """the distinct lowercase words in some text"""
+    return set(TOKEN.findall(text.lower()))
+
+
+class SearchIndex:
+    """An inverted index from words to the entries of TextObjectFiles
+    which contain them, stored in an sqlite database
+
+    Postings point from a word to an entry, and each entry records its
+    file and byte offset. TextObjectFiles opened with a search index add
+    postings for the entries they append, and when they rewrite the file
+    to remove or replace entries they drop the postings of those entries,
+    add postings for the replacements and shift the offsets of the entries
+    which moved, leaving their postings alone. Every file records the
+    inode, size and mtime it was indexed at, a file changed outside of
+    cap is reindexed the next time it is searched.
+
+    Args:
+        path (:obj: pathlib.Path): where to keep the database
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+            version, = self._connection.execute('PRAGMA user_version').fetchone()
+            if version != SCHEMA_VERSION:
+                self._connection.executescript(f'''
+                    DROP TABLE IF EXISTS files;
+                    DROP TABLE IF EXISTS entries;
+                    DROP TABLE IF EXISTS postings;
+                    PRAGMA user_version = {SCHEMA_VERSION};
+                ''')
+            self._connection.executescript('''
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY, path TEXT UNIQUE, ino INTEGER, size INTEGER, mtime INTEGER);
+                CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, file INTEGER, offset INTEGER);
+                CREATE INDEX IF NOT EXISTS entries_by_file ON entries (file);
+                CREATE TABLE IF NOT EXISTS postings (
+                    token TEXT, entry INTEGER, PRIMARY KEY (token, entry)) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_by_entry ON postings (entry);
+                CREATE TEMP TABLE IF NOT EXISTS removed (offset INTEGER PRIMARY KEY);
+                CREATE TEMP TABLE IF NOT EXISTS moved (offset INTEGER PRIMARY KEY, shift INTEGER);
+            ''')
+        return self._connection
+
+    def _file(self, path):
+        """the id and signature of an indexed file, or (None, None)"""
+        row = self.connection.execute(
+                'SELECT id, ino, size, mtime FROM files WHERE path = ?', (str(path),)).fetchone()
+        return (row[0], tuple(row[1:])) if row else (None, None)
+
+    @staticmethod
+    def _insert(connection, file, entries):
+        """add entries at new offsets and the postings for their words
+
+        Args:
+            entries (list): (offset, text) of each entry
+        """
+        if not entries:
+            return
+        # new entries are given ids after every existing one
+        last, = connection.execute('SELECT COALESCE(MAX(id), 0) FROM entries').fetchone()
+        connection.executemany('INSERT INTO entries (file, offset) VALUES (?, ?)',
+                [(file, offset) for offset, _ in entries])
+        ids = dict(connection.execute('SELECT offset, id FROM entries WHERE id > ? AND file = ?',
+                (last, file)).fetchall())
+        connection.executemany('INSERT OR IGNORE INTO postings VALUES (?, ?)',
+                [(token, ids[offset]) for offset, text in entries for token in tokens(text)])
+
+    @staticmethod
+    def _delete(connection, file, where='', parameters=()):
+        """drop the entries of a file which satisfy `where`, and their postings"""
+        connection.execute(f'''DELETE FROM postings WHERE entry IN (
+                SELECT id FROM entries WHERE file = ? {where})''', (file, *parameters))
+        connection.execute(f'DELETE FROM entries WHERE file = ? {where}', (file, *parameters))
+
+    def appended(self, textobjectfile, signature, entries):
+        """add the postings for entries appended to a file
+
+        Args:
+            textobjectfile (:obj: TextObjectFile): the file appended to
+            signature (tuple): the file's signature before the append. if
+                the index wasn't up to date with it nothing is done, the
+                file will be reindexed when next searched
+            entries (iterable): (offset, text) of each appended entry
+        """
+        with self.lock, self.connection as connection:
+            file, indexed = self._file(textobjectfile.path)
+            if indexed != signature:
+                return
+            self._insert(connection, file, list(entries))
+            connection.execute('UPDATE files SET ino = ?, size = ?, mtime = ? WHERE id = ?',
+                    (*filesignature(textobjectfile.path), file))
+
+    def rewritten(self, textobjectfile, signature, removed, moved, added):
+        """update the postings of a file which was rewritten to remove or
+        replace entries, without reading it again
+
+        Args:
+            textobjectfile (:obj: TextObjectFile): the rewritten file
+            signature (tuple): the file's signature before the rewrite. if
+                the index wasn't up to date with it nothing is done, the
+                file will be reindexed when next searched
+            removed (iterable): the old offsets of the entries which were
+                removed or replaced
+            moved (iterable): (offset, shift) pairs in order, the entries
+                from an old offset up to the next pair moved by `shift` bytes
+            added (iterable): (offset, text) of each entry written in place
+                of another, at its new offset
+        """
+        with self.lock, self.connection as connection:
+            file, indexed = self._file(textobjectfile.path)
+            if indexed != signature:
+                return
+            connection.execute('DELETE FROM temp.removed')
+            connection.execute('DELETE FROM temp.moved')
+            connection.executemany('INSERT OR IGNORE INTO temp.removed VALUES (?)', ((offset,) for offset in removed))
+            connection.executemany('INSERT OR REPLACE INTO temp.moved VALUES (?, ?)', moved)
+            self._delete(connection, file, 'AND offset IN (SELECT offset FROM temp.removed)')
+            connection.execute('''
+                UPDATE entries SET offset = offset + (SELECT shift FROM temp.moved
+                    WHERE moved.offset <= entries.offset ORDER BY moved.offset DESC LIMIT 1)
+                WHERE file = ? AND offset >= (SELECT MIN(offset) FROM temp.moved)''', (file,))
+            self._insert(connection, file, list(added))
+            connection.execute('UPDATE files SET ino = ?, size = ?, mtime = ? WHERE id = ?',
+                    (*filesignature(textobjectfile.path), file))
+
+    def refresh(self, textobjectfile):
+        """reindex a file if it changed since it was last indexed"""
+        signature = filesignature(textobjectfile.path)
+        with self.lock, self.connection as connection:
+            file, indexed = self._file(textobjectfile.path)
+            if indexed == signature:
+                return
+            if file is None:
+                file = connection.execute('INSERT INTO files (path) VALUES (?)',
+                        (str(textobjectfile.path),)).lastrowid
+            self._delete(connection, file)
+            with mapped(textobjectfile.path) as buffer:
+                self._insert(connection, file, [(match.start(), match.group(0).decode())
+                    for match in textobjectfile.textobjectcls.matches(buffer)])
+            connection.execute('UPDATE files SET ino = ?, size = ?, mtime = ? WHERE id = ?',
+                    (*signature, file))
+
+    def forget(self, path):
+        """drop a file from the index"""
+        with self.lock, self.connection as connection:
+            file, _ = self._file(path)
+            if file is not None:
+                self._delete(connection, file)
+                connection.execute('DELETE FROM files WHERE id = ?', (file,))
+
+    def search(self, terms, textobjectfiles):
+        """find the entries which contain every term
+
+        Args:
+            terms (str): the words to search for
+            textobjectfiles (iterable): the files to search, any which
+                changed since they were indexed are reindexed first
+
+        Returns:
+            a list of (TextObjectFile, entry) tuples
+        """
+        words = sorted(tokens(terms))
+        textobjectfiles = {str(tof.path): tof for tof in textobjectfiles}
+        if not words:
+            return []
+        for textobjectfile in textobjectfiles.values():
+            self.refresh(textobjectfile)
+        query = ' INTERSECT '.join(['SELECT entry FROM postings WHERE token = ?'] * len(words))
+        with self.lock:
+            rows = self.connection.execute(f'''
+                SELECT files.path, entries.offset FROM ({query}) AS found
+                JOIN entries ON entries.id = found.entry JOIN files ON files.id = entries.file
+                ORDER BY files.path, entries.offset''', words).fetchall()
+        offsets = {}
+        for path, offset in rows:
+            if path in textobjectfiles:
+                offsets.setdefault(path, []).append((offset, 0))
+        return [(textobjectfiles[path], entry) for path, spans in offsets.items()
+                for entry in textobjectfiles[path]._read_at(spans)]
@@ -0,0 +1,336 @@
+"""A TextObjectFile split over numbered segment files
+
+A segmented list is a directory, `<name>.seg`, holding a manifest and
+the segments `<name>.000001.txt`, `<name>.000002.txt` and so on, each a
+plain text TextObjectFile. Entries are appended to the last segment
+until it holds `segment_size` bytes, then a new segment is started.
+Removing or replacing entries only rewrites the segments which hold
+them, so a change costs about the size of a segment rather than the
+size of the list.
+
+The manifest records the segment size, the segments in order and how
+many entries each holds, so that entries can be found by position
+without counting every segment. It is replaced atomically whenever it
+changes. The empty match at the end of each segment is not an entry.
+"""
+from bisect import bisect_right
+from collections import Counter
+from itertools import accumulate
+from pathlib import Path
+from cap.store.textobjectfiles import TextObjectFile, without_end, _key
+from cap.store.parallel import read_files
+from cap.store.query import parse_conditions
+from cap.plugins import textobjecttypes
+import json
+import os
+
+SEGMENT_SIZE = 1 << 22
+MANIFEST = 'manifest.json'
+
+
+class SegmentedTextObjectFile(TextObjectFile):
+    """A TextObjectFile stored as segments, see the module docstring.
+    `index`, `cache`, `tombstones` and `snapshot` apply to each segment,
+    `search_index` only applies to text files and is ignored
+
+    Args:
+        path (:obj: pathlib.Path): the directory of the segments
+        textobjectcls (class, str): the RegexTextObject stored in it, or its name
+        segment_size (int): how many bytes a segment holds before a new one
+            is started. only used when the list is created, afterwards the
+            size in the manifest is kept
+    """
+    backend = 'segmented'
+
+    def __init__(self, path, textobjectcls, segment_size=SEGMENT_SIZE, search_index=None, **options):
+        if isinstance(textobjectcls, str):
+            textobjectcls = textobjecttypes[textobjectcls]
+        self.manifest_path = Path(path)/MANIFEST
+        if not self.manifest_path.exists():
+            self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            self._save({'segment_size': segment_size, 'next': 1, 'segments': [], 'counts': {}})
+        # the options apply to the segments, the directory itself has none
+        super().__init__(path, textobjectcls)
+        self.options = options
+        self.indexed_attributes = set()
+        self.opened = {}
+
+    def manifest(self):
+        return json.loads(self.manifest_path.read_text())
+
+    def _save(self, manifest):
+        temp = self.manifest_path.with_name(f'.{MANIFEST}.tmp')
+        temp.write_text(json.dumps(manifest))
+        os.replace(temp, self.manifest_path)
+
+    def segments(self):
+        """the segments in order, as TextObjectFiles"""
+        return [self._segment(name) for name in self.manifest()['segments']]
+
+    def _segment(self, name):
+        if name not in self.opened:
+            segment = TextObjectFile(self.path/name, self.textobjectcls, **self.options)
+            for attribute in self.indexed_attributes:
+                segment.index_attribute(attribute)
+            self.opened[name] = segment
+        return self.opened[name]
+
+    def _start_segment(self, manifest):
+        """add a new segment after the others"""
+        name = f'{self.path.stem}.{manifest["next"]:06d}.txt'
+        manifest['next'] += 1
+        manifest['segments'].append(name)
+        manifest.setdefault('counts', {})[name] = 0
+        self._save(manifest)
+        return self._segment(name)
+
+    def counts(self):
+        """how many entries each segment holds, in order. counts missing
+        from the manifest are counted and saved"""
+        manifest = self.manifest()
+        counts = manifest.setdefault('counts', {})
+        missing = [name for name in manifest['segments'] if name not in counts]
+        for name in missing:
+            counts[name] = len(self._segment(name))
+        if missing:
+            self._save(manifest)
+        return [counts[name] for name in manifest['segments']]
+
+    def _recount(self, segments):
+        """count the segments again after entries were removed from them"""
+        manifest = self.manifest()
+        counts = manifest.setdefault('counts', {})
+        for segment in segments:
+            counts[segment.path.name] = len(segment)
+        self._save(manifest)
+
+    def entries(self, lazy=False, processes=False):
+        """iterate the entries of every segment in order
+
+        Args:
+            lazy (bool): yield `TextObjectRecord`s, see `TextObjectFile.entries`
+            processes (bool): parse the segments in a process pool, see
+                `parallel.read_files`
+        """
+        if processes:
+            for _, entries in read_files(self.segments(), processes=True):
+                yield from without_end(entries)
+            return
+        for segment in self.segments():
+            yield from without_end(segment.entries(lazy=lazy))
+
+    def keys(self):
+        keys = Counter()
+        for segment in self.segments():
+            keys.update(segment.keys())
+        return keys
+
+    def modified(self):
+        """a (version, mtime) pair which changes whenever the entries do.
+        the version is a hash of the size and mtime of the manifest and
+        the versions of every segment"""
+        st = os.stat(self.manifest_path)
+        versions = [(st.st_size, st.st_mtime_ns)] + [segment.modified() for segment in self.segments()]
+        return hash(tuple(versions)) & (1 << 64) - 1, max(mtime for _, mtime in versions)
+
+    def add(self, *items, unique=False):
+        """append items to the last segment, starting new segments as
+        each one fills up
+
+        Args:
+            *items: the `textobjectcls` instances, or their text, to add
+            unique (bool): skip items which are already in the list
+
+        Raises:
+            ValueError: if an item is not a `textobjectcls`
+        """
+        keys = self.keys() if unique else None
+        texts, added = [], set()
+        for item in items:
+            text = str(item)
+            if not self.textobjectcls.valid(text):
+                raise ValueError(f"{item} is not a {self.textobjectcls}")
+            if unique:
+                if _key(text) in keys or _key(text) in added:
+                    continue
+                added.add(_key(text))
+            texts.append(text)
+        if not texts:
+            return
+        manifest = self.manifest()
+        if manifest['segments']:
+            segment = self._segment(manifest['segments'][-1])
+            size = os.stat(segment.path).st_size
+        else:
+            segment, size = self._start_segment(manifest), 0
+        pending, counts = [], manifest.setdefault('counts', {})
+        for text in texts:
+            if size >= manifest['segment_size']:
+                if pending:
+                    segment.add(*pending)
+                    counts[segment.path.name] = counts.get(segment.path.name, 0) + len(pending)
+                segment, size, pending = self._start_segment(manifest), 0, []
+            pending.append(text)
+            size += len(text.encode()) + 1
+        segment.add(*pending)
+        if segment.path.name in counts:
+            counts[segment.path.name] += len(pending)
+        self._save(manifest)
+
+    def _holding(self, keys):
+        """the segments which hold any of the keys, with the keys each holds
+
+        Raises:
+            ValueError: if a key is in no segment
+        """
+        holding, found = [], set()
+        for segment in self.segments():
+            held = {key for key in keys if key in segment.keys()}
+            if held:
+                holding.append((segment, held))
+                found |= held
+        missing = set(keys) - found
+        if missing:
+            raise ValueError(f"{', '.join(sorted(missing))} not in {self.path}")
+        return holding
+
+    def remove(self, *items):
+        """remove every occurance of the items from the segments which
+        hold them. with tombstones the items are recorded as dead
+
+        Raises:
+            ValueError: if an item is not a `textobjectcls` or is not in the list
+        """
+        removals = {self._validated(item) for item in items}
+        holding = self._holding(removals)
+        for segment, held in holding:
+            segment.remove(*held)
+        self._recount(segment for segment, _ in holding)
+        self._drop_empty()
+
+    def batch(self, remove=(), replace=None):
+        """remove and replace entries, rewriting only the segments which
+        hold them, see `TextObjectFile.batch`
+
+        Raises:
+            ValueError: if an item is not a `textobjectcls` or is not in the list
+        """
+        removals = {self._validated(item) for item in remove}
+        replacements = {self._validated(item): self._validated(new_item)
+                for item, new_item in (replace or {}).items()}
+        holding = self._holding(removals | set(replacements))
+        for segment, held in holding:
+            segment.batch(remove=held & removals,
+                    replace={key: replacements[key] for key in held if key in replacements})
+        self._recount(segment for segment, _ in holding)
+        self._drop_empty()
+
+    def apply(self, operations):
+        """apply a sequence of adds, removes and replaces in order, each
+        one rewriting only the segments it changes, see `TextObjectFile.apply`
+
+        Returns:
+            a list with None for each operation which succeeded or the
+            exception raised by each one which failed
+        """
+        results = []
+        for operation, items in operations:
+            try:
+                if operation == 'add':
+                    self.add(*items)
+                elif operation == 'remove':
+                    self.batch(remove=items)
+                elif operation == 'replace':
+                    self.batch(replace=items)
+                else:
+                    raise ValueError(f'{operation} is not an operation')
+            except Exception as exception:
+                results.append(exception)
+            else:
+                results.append(None)
+        return results
+
+    def _drop_empty(self):
+        """drop the segments left empty, apart from the last which is
+        still being appended to"""
+        manifest = self.manifest()
+        empty = [name for name in manifest['segments'][:-1]
+                if not os.stat(self.path/name).st_size]
+        if empty:
+            manifest['segments'] = [name for name in manifest['segments'] if name not in empty]
+            for name in empty:
+                manifest.get('counts', {}).pop(name, None)
+            self._save(manifest)
+            for name in empty:
+                self._segment(name).delete()
+                del self.opened[name]
+
+    def index_attribute(self, attribute):
+        """keep a secondary index by an attribute in every segment, see
+        `TextObjectFile.index_attribute`"""
+        self.indexed_attributes.add(attribute)
+        for segment in self.opened.values():
+            segment.index_attribute(attribute)
+
+    def query(self, *predicates, **conditions):
+        """the entries of every segment which satisfy the conditions, see
+        `TextObjectFile.query`
+
+        Returns:
+            a list of the matching entries
+        """
+        predicates = parse_conditions(*predicates, **conditions)
+        return [entry for segment in self.segments() for entry in segment.query(*predicates)]
+
+    def compact(self, threshold=None):
+        """compact each segment, see `TextObjectFile.compact`
+
+        Returns:
+            True if any segment was compacted
+        """
+        segments = self.segments()
+        compacted = [segment.compact(threshold) for segment in segments]
+        self._recount(segment for segment, done in zip(segments, compacted) if done)
+        self._drop_empty()
+        return any(compacted)
+
+    def dead_ratio(self):
+        sizes = [(segment.dead_ratio(), os.stat(segment.path).st_size) for segment in self.segments()]
+        return sum(ratio * size for ratio, size in sizes) / max(sum(size for _, size in sizes), 1)
+
+    def delete(self):
+        """delete every segment, the manifest and the directory"""
+        for segment in self.segments():
+            segment.delete()
+        self.opened = {}
+        self.manifest_path.unlink()
+        self.path.rmdir()
+
+    def __len__(self):
+        return sum(self.counts())
+
+    def __getitem__(self, key):
+        """get the entry at a position, or a list of entries for a slice,
+        finding the segments from the counts in the manifest. each segment
+        holding a requested entry is read once"""
+        segments, counts = self.segments(), self.counts()
+        starts = list(accumulate(counts, initial=0))
+        positions = range(starts[-1])[key]
+        if not isinstance(key, slice):
+            i = bisect_right(starts, positions) - 1
+            return segments[i][positions - starts[i]]
+        located = [(i, position - starts[i]) for position in positions
+                for i in [bisect_right(starts, position) - 1]]
+        wanted = {}
+        for i, position in located:
+            wanted.setdefault(i, []).append(position)
+        found = {}
+        for i, local in wanted.items():
+            first = min(local)
+            read = segments[i][first:max(local) + 1]
+            found.update(((i, position), read[position - first]) for position in local)
+        return [found[location] for location in located]
+
+    def __contains__(self, item):
+        return any(_key(item) in segment.keys() for segment in self.segments())
+
@@ -0,0 +1,168 @@
+from array import array
+from contextlib import contextmanager
+from itertools import chain
+from pathlib import Path
+from cap.store.textobjects import SpanMatch, TextObjectRecord
+from cap.utils import mapped
+from cap.metrics import count
+import hashlib
+import mmap
+import os
+import struct
+
+MAGIC = b'CAPSNP1\n'
+# magic, size and mtime of the file, hash of the file, hash of the regex,
+# number of entries, offsets per entry
+HEADER = struct.Struct('<8sQQ16s16sQQ')
+DIGEST_SIZE = 16
+# how many entries' offsets are turned into python ints at a time
+ROWS = 1 << 14
+
+
+class Snapshot:
+    """A sidecar to a TextObjectFile holding the parse of the file, so
+    that a new process can load the entries without searching the file
+    with the type's regex
+
+    The sidecar is kept next to the file as `.<name>.snap`: a header and
+    then, for every entry, the byte offsets of its start and end and of the
+    start and end of each of its groups (-1 for a group which didn't match).
+    It is memory mapped to read. The header records the size, mtime and a
+    blake2b hash of the file it was built from, and a hash of the regex.
+    The snapshot is trusted for as long as the size and mtime are
+    unchanged, failing those the hash, and is rebuilt otherwise.
+
+    Args:
+        path (:obj: pathlib.Path): the path to the file the entries are in
+        textobjectcls (class): the RegexTextObject stored in the file
+    """
+    def __init__(self, path, textobjectcls):
+        self.textpath = Path(path)
+        self.path = self.textpath.with_name(f'.{self.textpath.name}.snap')
+        self.textobjectcls = textobjectcls
+        regex = textobjectcls.regex
+        self.width = 2 * (regex.groups + 1)
+        self.regexdigest = _digest(f'{regex.pattern}\0{regex.flags}'.encode())
+
+    @contextmanager
+    def spans(self):
+        """the file and the offsets of its entries, from the snapshot if it
+        is fresh, otherwise from a new snapshot built from the file
+
+        Yields:
+            (buffer, offsets): the memory mapped file and a flat sequence
+            of `width` byte offsets per entry
+        """
+        mtime = os.stat(self.textpath).st_mtime_ns
+        with mapped(self.textpath) as buffer:
+            fresh = self._fresh(buffer, mtime)
+            count('cache_requests', cache='snapshot', result='hit' if fresh else 'miss')
+            if not fresh:
+                self.build(buffer, mtime)
+            with self.path.open('rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as snapshot:
+                with memoryview(snapshot) as view, view[HEADER.size:].cast('q') as offsets:
+                    yield buffer, offsets
+
+    def _header(self):
+        try:
+            with self.path.open('rb') as f:
+                magic, *header = HEADER.unpack(f.read(HEADER.size))
+        except (OSError, struct.error):
+            return None
+        return header if magic == MAGIC else None
+
+    def _fresh(self, buffer, mtime):
+        header = self._header()
+        if header is None:
+            return False
+        size, modified, digest, regexdigest, entries, width = header
+        if (regexdigest, width, size) != (self.regexdigest, self.width, len(buffer)):
+            return False
+        if modified == mtime:
+            return True
+        if digest != _digest(buffer):
+            return False
+        # the file was touched without changing, keep the snapshot
+        with self.path.open('r+b') as f:
+            f.write(HEADER.pack(MAGIC, size, mtime, digest, regexdigest, entries, width))
+        return True
+
+    def build(self, buffer, mtime):
+        """parse the file and write a fresh snapshot
+
+        Args:
+            buffer (:obj: mmap.mmap): the contents of the file
+            mtime (int): the mtime of the file, in nanoseconds
+        """
+        offsets = array('q')
+        for match in self.textobjectcls.matches(buffer):
+            offsets.extend(chain.from_iterable(match.regs))
+        temp = self.path.with_name(f'{self.path.name}.tmp')
+        with temp.open('wb') as f:
+            f.write(HEADER.pack(MAGIC, len(buffer), mtime, _digest(buffer), self.regexdigest,
+                len(offsets) // self.width, self.width))
+            offsets.tofile(f)
+        os.replace(temp, self.path)
+
+    def _rows(self, offsets):
+        width = self.width
+        for start in range(0, len(offsets), ROWS * width):
+            flat = offsets[start:start + ROWS * width].tolist()
+            for i in range(0, len(flat), width):
+                yield flat[i:i + width]
+
+    def entries(self):
+        """the entries of the file, created from the snapshot. each entry's
+        groups are sliced from the memory mapped file
+
+        Yields:
+            `textobjectcls` instances
+        """
+        cls = self.textobjectcls
+        groupindex = cls.regex.groupindex
+        with self.spans() as (buffer, offsets):
+            for row in self._rows(offsets):
+                yield cls._from_match(SpanMatch(buffer, row, groupindex))
+
+    def records(self):
+        """the entries of the file as `TextObjectRecord`s, which only
+        create the full object when its attributes are used
+
+        Yields:
+            (offset, record) for each entry, offset being where the entry
+            starts in the file
+        """
+        cls = self.textobjectcls
+        with self.spans() as (buffer, offsets):
+            for row in self._rows(offsets):
+                start, end = row[0], row[1]
+                yield start, TextObjectRecord(cls, buffer[start:end], 0, end - start)
+
+    def __len__(self):
+        with self.spans() as (_, offsets):
+            return len(offsets) // self.width
+
+    def __getitem__(self, key):
+        """the entry at a position, or a list of entries for a slice,
+        reading only their offsets from the snapshot"""
+        positions = range(len(self))[key]
+        entries = self.at(positions if isinstance(key, slice) else [positions])
+        return entries if isinstance(key, slice) else entries[0]
+
+    def at(self, positions):
+        """the entries at the positions, which must be in range"""
+        cls, width = self.textobjectcls, self.width
+        with self.spans() as (buffer, offsets):
+            return [cls._from_match(SpanMatch(buffer, offsets[i * width:(i + 1) * width].tolist(),
+                cls.regex.groupindex)) for i in positions]
+
+    def invalidate(self):
+        """drop the snapshot after the file was rewritten"""
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
@@ -0,0 +1,334 @@
+"""A TextObjectFile backend which stores entries in an sqlite database
+
+Each entry is a row holding its text, without surrounding whitespace, and
+a column for every named group of the type, with the group's value as
+the entry's attribute has it. The text and every group column are
+indexed, so adding, removing, replacing and finding an entry and
+equality and prefix queries on a group take O(log n). Entries keep the
+order they were added in.
+
+Databases are opened in WAL mode, so readers don't block the writer.
+`import_text` and `export_text` convert to and from the plain text
+format, one entry per line.
+"""
+from collections import Counter
+from threading import RLock
+from cap.store.textobjectfiles import TextObjectFile, _key
+from cap.store.textobjects import TextObjectRecord
+from cap.store.query import Equals, Prefix, parse_conditions, select
+from cap.metrics import timing, timed
+from cap.plugins import textobjecttypes
+from cap.utils import chunks
+import os
+import sqlite3
+import time
+
+# sorts after every string a prefix query could match
+PREFIX_END = '\U0010ffff'
+IMPORT_CHUNK = 10_000
+
+
+class SQLiteTextObjectFile(TextObjectFile):
+    """A TextObjectFile stored in an sqlite database, see the module
+    docstring. `index`, `cache`, `search_index` and `tombstones` only
+    apply to text files and are ignored
+
+    Args:
+        path (:obj: pathlib.Path): the database
+        textobjectcls (class, str): the RegexTextObject stored in it, or its name
+    """
+    backend = 'sqlite'
+
+    def __init__(self, path, textobjectcls, **ignored):
+        if isinstance(textobjectcls, str):
+            textobjectcls = textobjecttypes[textobjectcls]
+        super().__init__(path, textobjectcls)
+        self.groups = list(textobjectcls.regex.groupindex)
+        self.lock = RLock()
+        self._connection = None
+        self.connection  # create the database
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            connection.executescript('''
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, text TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS entries_text ON entries (text);
+                CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER);
+                INSERT OR IGNORE INTO meta VALUES ('version', 0), ('modified', 0);
+            ''')
+            columns = {row[1] for row in connection.execute('PRAGMA table_info(entries)')}
+            for group in self.groups:
+                if _column(group) not in columns:
+                    connection.execute(f'ALTER TABLE entries ADD COLUMN "{_column(group)}" TEXT')
+                connection.execute(f'CREATE INDEX IF NOT EXISTS "entries_{_column(group)}" '
+                        f'ON entries ("{_column(group)}")')
+            self._connection = connection
+        return self._connection
+
+    def _write(self):
+        """a transaction which records that the list changed"""
+        return _Transaction(self)
+
+    def _row(self, key):
+        """the values of an entry's row, its text and then its groups"""
+        entry = self.textobjectcls.match(key)
+        values = [getattr(entry, group, None) for group in self.groups]
+        return (key, *(None if value is None else str(value) for value in values))
+
+    def _insert(self, keys):
+        placeholders = ', '.join('?' * (len(self.groups) + 1))
+        columns = ', '.join(['text'] + [f'"{_column(group)}"' for group in self.groups])
+        self.connection.executemany(f'INSERT INTO entries ({columns}) VALUES ({placeholders})',
+                [self._row(key) for key in keys])
+
+    def _count(self, key):
+        return self.connection.execute('SELECT COUNT(*) FROM entries WHERE text = ?', (key,)).fetchone()[0]
+
+    def _entry(self, text, lazy=False):
+        if lazy:
+            return TextObjectRecord(self.textobjectcls, text, 0, len(text))
+        return self.textobjectcls._from_match(self.textobjectcls.regex.match(text))
+
+    def entries(self, lazy=False):
+        """iterate the entries in the order they were added
+
+        Args:
+            lazy (bool): yield `TextObjectRecord`s which only parse their
+                groups when an attribute is used
+        """
+        return timed(self._entries(lazy), 'textobjectfile.read', list=self.path.stem)
+
+    def _entries(self, lazy):
+        with self.lock:
+            rows = self.connection.execute('SELECT text FROM entries ORDER BY id').fetchall()
+        for text, in rows:
+            yield self._entry(text, lazy)
+
+    def keys(self):
+        with self.lock:
+            return Counter(dict(self.connection.execute('SELECT text, COUNT(*) FROM entries GROUP BY text')))
+
+    def modified(self):
+        with self.lock:
+            meta = dict(self.connection.execute('SELECT name, value FROM meta'))
+        return meta['version'], meta['modified']
+
+    def add(self, *items, unique=False):
+        """add items after the existing entries
+
+        Args:
+            *items: the `textobjectcls` instances, or their text, to add
+            unique (bool): skip items which are already in the list
+
+        Raises:
+            ValueError: if an item is not a `textobjectcls`
+        """
+        with timing('textobjectfile.add', list=self.path.stem):
+            keys = [self._validated(item) for item in items]
+            with self._write():
+                if unique:
+                    keys = [key for key in dict.fromkeys(keys) if not self._count(key)]
+                self._insert(keys)
+
+    def remove(self, *items):
+        self.batch(remove=items)
+
+    def batch(self, remove=(), replace=None):
+        """remove and replace entries in one transaction, see
+        `TextObjectFile.batch`
+
+        Raises:
+            ValueError: if an item is not a `textobjectcls` or is not in the list
+        """
+        with timing('textobjectfile.batch', list=self.path.stem):
+            removals = {self._validated(item) for item in remove}
+            replacements = {self._validated(item): self._validated(new_item)
+                    for item, new_item in (replace or {}).items()}
+            with self._write():
+                self._check_present(removals | set(replacements), self._count)
+                self._remove(removals)
+                self._replace(replacements)
+
+    def _remove(self, keys):
+        self.connection.executemany('DELETE FROM entries WHERE text = ?', [(key,) for key in keys])
+
+    def _replace(self, replacements):
+        # every entry to replace is found before any is replaced, so that
+        # replacements can swap entries
+        ids = {key: [row[0] for row in self.connection.execute(
+            'SELECT id FROM entries WHERE text = ?', (key,))] for key in replacements}
+        columns = ', '.join(['text = ?'] + [f'"{_column(group)}" = ?' for group in self.groups])
+        self.connection.executemany(f'UPDATE entries SET {columns} WHERE id = ?',
+                [(*self._row(replacements[key]), i) for key, found in ids.items() for i in found])
+
+    def apply(self, operations):
+        """apply a sequence of adds, removes and replaces in order, in one
+        transaction, see `TextObjectFile.apply`
+
+        Returns:
+            a list with None for each operation which succeeded or the
+            exception raised by each one which failed
+        """
+        results = []
+        with timing('textobjectfile.apply', list=self.path.stem), self._write():
+            for operation, items in operations:
+                self.connection.execute('SAVEPOINT operation')
+                try:
+                    if operation == 'add':
+                        self._insert([self._validated(item) for item in items])
+                    elif operation == 'remove':
+                        removals = {self._validated(item) for item in items}
+                        self._check_present(removals, self._count)
+                        self._remove(removals)
+                    elif operation == 'replace':
+                        replacements = {self._validated(item): self._validated(new_item)
+                                for item, new_item in items.items()}
+                        self._check_present(replacements, self._count)
+                        self._replace(replacements)
+                    else:
+                        raise ValueError(f'{operation} is not an operation')
+                except Exception as exception:
+                    self.connection.execute('ROLLBACK TO operation')
+                    results.append(exception)
+                else:
+                    results.append(None)
+                self.connection.execute('RELEASE operation')
+        return results
+
+    def _check_present(self, keys, count):
+        missing = [key for key in keys if not count(key)]
+        if missing:
+            raise ValueError(f"{', '.join(sorted(missing))} not in {self.path}")
+
+    def index_attribute(self, attribute):
+        """every group is indexed already"""
+
+    def query(self, *predicates, **conditions):
+        """the entries whose attributes satisfy every condition, see
+        `TextObjectFile.query`. an equality or prefix condition on a group
+        is answered with the group's index
+
+        Returns:
+            a list of the matching entries
+        """
+        predicates = parse_conditions(*predicates, **conditions)
+        for predicate in predicates:
+            if predicate.attribute not in self.groups or not isinstance(predicate, (Equals, Prefix)):
+                continue
+            column = f'"{_column(predicate.attribute)}"'
+            if isinstance(predicate, Equals):
+                where, args = f'{column} = ?', (predicate.value,)
+            else:
+                where, args = f'{column} >= ? AND {column} < ?', (predicate.value, predicate.value + PREFIX_END)
+            with self.lock:
+                rows = self.connection.execute(f'SELECT text FROM entries WHERE {where} ORDER BY id', args).fetchall()
+            return select([self._entry(text) for text, in rows], [p for p in predicates if p is not predicate])
+        return select(self.entries(lazy=True), predicates)
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def __getitem__(self, key):
+        """get the entry at a position, or a list of entries for a slice"""
+        positions = range(len(self))[key]
+        if not isinstance(key, slice):
+            return self._at(positions, 1)[0]
+        if not positions:
+            return []
+        first = min(positions)
+        entries = self._at(first, max(positions) - first + 1)
+        return [entries[i - first] for i in positions]
+
+    def _at(self, offset, limit):
+        with self.lock:
+            rows = self.connection.execute('SELECT text FROM entries ORDER BY id LIMIT ? OFFSET ?',
+                    (limit, offset)).fetchall()
+        return [self._entry(text) for text, in rows]
+
+    def __contains__(self, item):
+        with self.lock:
+            return bool(self._count(_key(item)))
+
+    def compact(self, threshold=None):
+        """sqlite reuses the space of removed entries itself"""
+        return False
+
+    def dead_ratio(self):
+        return 0.0
+
+    def delete(self):
+        """delete the database"""
+        self.close()
+        for path in (self.path, self.path.with_name(f'{self.path.name}-wal'),
+                self.path.with_name(f'{self.path.name}-shm')):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        with self.lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def import_text(self, path):
+        """add the entries of a plain text file, a chunk at a time
+
+        Args:
+            path (:obj: pathlib.Path): the text file, one entry per line
+                as TextObjectFile writes them
+        """
+        with open(path, 'rb') as f, self._write():
+            for chunk in chunks(f):
+                matches = self.textobjectcls.matches(chunk.decode())
+                self._insert([key for key in (_key(match.group(0)) for match in matches) if key])
+
+    def export_text(self, path):
+        """write the entries to a plain text file, one per line. the file
+        is replaced atomically"""
+        temp = path.with_name(f'.{path.name}.tmp')
+        with self.lock:
+            cursor = self.connection.execute('SELECT text FROM entries ORDER BY id')
+            with temp.open('w') as out:
+                while rows := cursor.fetchmany(IMPORT_CHUNK):
+                    out.write(''.join(f'{text}\n' for text, in rows))
+        os.replace(temp, path)
+
+
+class _Transaction:
+    """holds the file's lock for a write transaction, and counts the
+    write in the meta table so that readers can tell the list changed"""
+    def __init__(self, textobjectfile):
+        self.textobjectfile = textobjectfile
+
+    def __enter__(self):
+        self.textobjectfile.lock.acquire()
+        try:
+            self.textobjectfile.connection.execute('BEGIN IMMEDIATE')
+        except BaseException:
+            self.textobjectfile.lock.release()
+            raise
+
+    def __exit__(self, exc_type, *exc_info):
+        connection = self.textobjectfile.connection
+        try:
+            if exc_type is None:
+                connection.execute("UPDATE meta SET value = value + 1 WHERE name = 'version'")
+                connection.execute("UPDATE meta SET value = ? WHERE name = 'modified'", (time.time_ns(),))
+                connection.execute('COMMIT')
+            else:
+                connection.execute('ROLLBACK')
+        finally:
+            self.textobjectfile.lock.release()
+
+
+def _column(group):
+    """the column a named group is stored in"""
+    return f'group_{group}'
@@ -1,9 +1,25 @@
 from pathlib import Path
+from itertools import islice
+from collections import Counter
+from contextlib import contextmanager
+from bisect import bisect_right
+import os
 import re
 from cap.store.textobjects import *
-from cap.utils import subclasses
+from cap.store.offsetindex import OffsetIndex
+from cap.store.parallel import read_files, parse
+from cap.store.query import AttributeIndex, parse_conditions, select
+from cap.store.tombstones import Tombstones
+from cap.store.snapshot import Snapshot
+from cap.store.backends import open_textobjectfile
+from cap.utils import subclasses, mapped, filesignature
+from cap.metrics import timing, timed, count
 from cap.plugins import textobjecttypes
 
+# above this many dead keys the entries are walked to find the dead ones,
+# rather than searching the file for each key
+FIND_KEYS = 64
+
 
 class TextObjectFile:
     """A file which contains instances of a TextObject
@@ -14,54 +30,630 @@ class TextObjectFile:
 
         path (:obj: pathlib.Path): the path to the file where `textobjectcls`
             occurances are / should be stored
+
+        index (:obj: OffsetIndex): if the file was opened with `index=True`, a sidecar
+            index of entry offsets which makes `len` and indexing constant time
+
+        cache (:obj: ParseCache): a cache of parsed entries to read through,
+            such as `parsecache.parse_cache`. reads after an append then only
+            parse the appended text. the cache holds the entries of the files
+            read most recently in memory, up to its `max_entries`. lazy and
+            process pool reads bypass it
+
+        search_index (:obj: SearchIndex): a full text index to add the
+            entries appended to the file to
+
+        tombstones (:obj: Tombstones): if the file was opened with `tombstones=True`,
+            a sidecar of removed entries. `remove` then records the entries as dead
+            instead of rewriting the file, readers skip them, and `compact`
+            or any other rewrite of the file drops them
+
+        snapshot (:obj: Snapshot): if the file was opened with `snapshot=True`, a
+            sidecar of the offsets of the entries and their groups, which a new
+            process loads instead of parsing the file. entries, `len` and
+            indexing are read from it, as is a full parse into the cache
+
+    A type whose regex matches empty text, such as `Line`, also matches at
+    the very end of the file. `len` and indexing leave that match out.
+
+    With tombstones, `len` and indexing through the index, the snapshot or
+    the cache skip the positions of the dead entries. these are found by
+    searching the file for the dead keys, and kept until the file or the
+    tombstones change other than by `add` and `remove`
     """
-    def __init__(self, path, textobjectcls):
+    backend = 'text'
+
+    def __init__(self, path, textobjectcls, index=False, cache=None, search_index=None,
+            tombstones=False, snapshot=False):
         self.textobjectcls = textobjectcls
         self.path = Path(path)
         if not self.path.exists():
             self.path.parent.mkdir(parents=True, exist_ok=True)
             self.path.touch()
+        self.index = OffsetIndex(self.path, textobjectcls) if index else None
+        self.cache = cache
+        self.search_index = search_index
+        self.tombstones = Tombstones(self.path) if tombstones else None
+        self.snapshot = Snapshot(self.path, textobjectcls) if snapshot else None
+        self._keys = None
+        self._keys_signature = None
+        self._dead_at = None
+        self._dead_at_signature = None
+        self._dead_pending = set()
+        self.attribute_indexes = {}
 
-    def entries(self):
-        yield from [textobj for textobj in self.textobjectcls.findall(self.path.read_text())]
+    def entries(self, lazy=False, processes=False):
+        """iterate the text objects in the file. the file is memory mapped
+        and searched one match at a time, so memory use does not grow
+        with the size of the file. with a cache other reads are made
+        through the cache instead
+
+        Args:
+            lazy (bool): yield compact `TextObjectRecord`s which only parse
+                their groups when an attribute is used
+            processes (bool, int): parse the file in chunks in a process pool,
+                or in this many processes, for large files of types whose
+                regexes are expensive. see `parallel.parse`
+        """
+        return timed(self._entries(lazy, processes), 'textobjectfile.read',
+                bytes=os.stat(self.path).st_size, list=self.path.stem)
+
+    def _entries(self, lazy, processes):
+        if self.cache is not None and not lazy and not processes:
+            yield from self._live(self.cache.entries(self.path, self.textobjectcls, self.snapshot))
+            return
+        if processes:
+            workers = None if processes is True else processes
+            yield from self._live(parse(self.path, self.textobjectcls, workers))
+            return
+        if self.snapshot is not None:
+            if not lazy:
+                yield from self._live(self.snapshot.entries())
+                return
+            dead = self._dead()
+            yield from (record for offset, record in self.snapshot.records()
+                    if not dead or not self.tombstones.is_dead(_key(record), offset))
+            return
+        with mapped(self.path) as buffer:
+            if not lazy:
+                yield from self._live(self.textobjectcls.finditer(buffer))
+            elif not self._dead():
+                yield from self.textobjectcls.records(buffer)
+            else:
+                # records copied out of the buffer don't know their offset
+                for match in self.textobjectcls.matches(buffer):
+                    text = match.group(0)
+                    if not self.tombstones.is_dead(_key(text.decode()), match.start()):
+                        yield TextObjectRecord(self.textobjectcls, text, 0, len(text))
 
     def __iter__(self):
         return self.entries
 
-    def add(self, *items):
-        with self.path.open('a') as f:
+    def _read_at(self, spans):
+        """read the entries at the given (offset, length) spans, leaving
+        out any which are dead"""
+        regex = self.textobjectcls.bytesregex()
+        with mapped(self.path) as buffer:
+            return list(self._live([self.textobjectcls._from_match(DecodedMatch(regex.match(buffer, offset)))
+                    for offset, _ in spans]))
+
+    def _dead(self):
+        """the tombstones of the file, or an empty dict"""
+        return self.tombstones.load() if self.tombstones is not None else {}
+
+    def _live(self, entries):
+        """the entries which have not been removed with a tombstone"""
+        if not self._dead():
+            return entries
+        return (entry for entry in entries
+                if not self.tombstones.is_dead(_key(str(entry)), entry.span()[0]))
+
+    @contextmanager
+    def _layout(self):
+        """where every entry is, dead or alive, from the index, the snapshot
+        or the cache
+
+        Yields:
+            (starts, span): the offset each entry starts at, in order, and a
+            function from a position to the (start, end) of its entry. None
+            if the file has none of them
+        """
+        if self.index is not None:
+            spans = self.index.load()
+            yield spans[0::2], lambda i: (spans[2 * i], spans[2 * i] + spans[2 * i + 1])
+        elif self.snapshot is not None:
+            width = self.snapshot.width
+            with self.snapshot.spans() as (_, offsets), offsets[0::width] as starts:
+                yield starts, lambda i: (offsets[i * width], offsets[i * width + 1])
+        elif self.cache is not None:
+            entries = self.cache.entries(self.path, self.textobjectcls, self.snapshot)
+            yield [entry.span()[0] for entry in entries], lambda i: entries[i].span()
+        else:
+            yield None
+
+    def _dead_positions(self):
+        """the positions of the dead entries among every entry, in order, see
+        `_layout`. only the keys removed since the last call are looked for
+
+        Returns:
+            a sorted list of positions, or None if the file has no layout
+        """
+        if not self._dead():
+            return []
+        signature = self._signature()
+        if self._dead_at_signature != signature:
+            self._dead_at, self._dead_pending = None, set()
+        if self._dead_at is not None and not self._dead_pending:
+            return self._dead_at
+        keys = self._dead() if self._dead_at is None else self._dead_pending
+        with self._layout() as layout:
+            if layout is None:
+                return None
+            found = self._find_dead(keys, *layout)
+        self._dead_at = sorted(found.union(self._dead_at or ()))
+        self._dead_at_signature, self._dead_pending = signature, set()
+        return self._dead_at
+
+    def _find_dead(self, keys, starts, span):
+        """the positions of the dead entries with the keys. the file is
+        searched for the text of each key, or for many keys every entry is
+        read"""
+        found = set()
+        with mapped(self.path) as buffer:
+            if len(keys) > FIND_KEYS or '' in keys:
+                for i in range(len(starts)):
+                    start, end = span(i)
+                    key = _key(buffer[start:end].decode())
+                    if key in keys and self.tombstones.is_dead(key, start):
+                        found.add(i)
+                return found
+            for key in keys:
+                text = key.encode()
+                at = buffer.find(text)
+                while at >= 0:
+                    i = bisect_right(starts, at) - 1
+                    if i >= 0:
+                        start, end = span(i)
+                        if (at < end and _key(buffer[start:end].decode()) == key
+                                and self.tombstones.is_dead(key, start)):
+                            found.add(i)
+                            at = end - 1
+                    at = buffer.find(text, at + 1)
+        return found
+
+    def keys(self):
+        """a count of the entries in the file by their text, without
+        surrounding whitespace. built on first use and kept up to date by
+        `add` and `batch`, rebuilt if the file was changed by something else
+
+        Returns:
+            a `collections.Counter` of entry texts
+        """
+        keys = self._current_keys()
+        count('cache_requests', cache='keys', result='miss' if keys is None else 'hit')
+        if keys is None:
+            signature, dead = self._signature(), self._dead()
+            with mapped(self.path) as buffer:
+                matches = ((_key(m.group(0).decode()), m.start()) for m in self.textobjectcls.matches(buffer))
+                keys = Counter(key for key, start in matches
+                        if not dead or not self.tombstones.is_dead(key, start))
+            self._keys, self._keys_signature = keys, signature
+        return keys
+
+    def modified(self):
+        """a (version, mtime) pair which changes whenever the entries do.
+        the version is the size of the file, or with tombstones a hash of
+        it and the signature of the sidecar, which a removal changes
+        without touching the file"""
+        st = os.stat(self.path)
+        tombstones = self.tombstones.stat() if self.tombstones is not None else None
+        if tombstones is None:
+            return st.st_size, st.st_mtime_ns
+        version = hash((st.st_size, st.st_mtime_ns, tombstones)) & (1 << 64) - 1
+        return version, max(st.st_mtime_ns, tombstones[2])
+
+    def _signature(self):
+        """the signature of the file and of its tombstones, which changes
+        whenever the entries do"""
+        tombstones = self.tombstones.stat() if self.tombstones is not None else None
+        return filesignature(self.path), tombstones
+
+    def _current_keys(self):
+        """the keys if they have been built and the entries haven't changed since"""
+        if self._keys is not None and self._keys_signature == self._signature():
+            return self._keys
+
+    def _rewritten(self):
+        """called after the file is rewritten in place"""
+        if self.index is not None:
+            self.index.invalidate()
+        if self.snapshot is not None:
+            self.snapshot.invalidate()
+        if self.cache is not None:
+            self.cache.invalidate(self.path)
+        self._keys = None
+        self._dead_at = self._dead_at_signature = None
+
+    def _changed_attribute_indexes(self, before, operations):
+        """update the attribute indexes which were fresh at `before` after
+        `operations`, see `AttributeIndex.changed`, and drop the others"""
+        after = self._signature()
+        for attribute_index in self.attribute_indexes.values():
+            if (attribute_index.signature == before
+                    and attribute_index.changed(operations, self.textobjectcls.match)):
+                attribute_index.signature = after
+            else:
+                attribute_index.invalidate()
+
+    def add(self, *items, unique=False):
+        """append items to the file
+
+        Args:
+            *items: the `textobjectcls` instances, or their text, to add
+            unique (bool): skip items which are already in the file
+
+        Raises:
+            ValueError: if an item is not a `textobjectcls`
+        """
+        with timing('textobjectfile.add', list=self.path.stem) as event:
+            keys = self.keys() if unique else self._current_keys()
+            texts, added = [], set()
             for item in items:
-                if self.textobjectcls.match(str(item)):
-                    print(str(item), file=f)
-                else:
+                text = str(item)
+                if not self.textobjectcls.valid(text):
                     raise ValueError(f"{item} is not a {self.textobjectcls}")
+                if unique:
+                    if _key(text) in keys or _key(text) in added:
+                        continue
+                    added.add(_key(text))
+                texts.append(text)
+            signature = self.index.stat() if self.index is not None else None
+            before = self._signature()
+            with self.path.open('a') as f:
+                f.write(''.join(f'{text}\n' for text in texts))
+            after = self._signature()
+            event.bytes = after[0][1] - before[0][1]
+            if self.index is not None:
+                self.index.appended(signature)
+            if keys is not None:
+                keys.update(_key(text) for text in texts)
+                self._keys_signature = after
+            # appended entries are alive and the others keep their positions
+            if self._dead_at_signature == before:
+                self._dead_at_signature = after
+            if self.search_index is not None:
+                offset, appended = before[0][1], []
+                for text in texts:
+                    appended.append((offset, text))
+                    offset += len(f'{text}\n'.encode())
+                self.search_index.appended(self, before[0], appended)
+            fresh = [i for i in self.attribute_indexes.values() if i.signature == before]
+            if fresh:
+                added = [self.textobjectcls.match(text) for text in texts]
+                for attribute_index in fresh:
+                    attribute_index.add(added)
+                    attribute_index.signature = after
 
     def remove(self, *items):
-        text = self.path.read_text()
-        for item in [str(it) for it in items]:
-            txtobj = self.textobjectcls.match(item)
-            if not txtobj:
-                raise ValueError(f"{item} is not a {self.textobjectcls}")
-            if not re.search(str(txtobj), text):
-                raise ValueError(f"{txtobj} is not in the file \n{text}")
-            text = text.replace(item, '')
-        self.path.write_text(text)
+        """remove every occurance of the items. with tombstones the items
+        are recorded as dead, without rewriting the file
+
+        Raises:
+            ValueError: if an item is not a `textobjectcls` or is not in the file
+        """
+        if self.tombstones is None:
+            self.batch(remove=items)
+            return
+        with timing('textobjectfile.remove', list=self.path.stem) as event:
+            keys = self.keys()
+            removals = {self._validated(item) for item in items}
+            self._check_present(removals, keys)
+            self._dead()
+            before = self._signature()
+            self.tombstones.add([(key, keys[key] * (len(key.encode()) + 1)) for key in removals],
+                    os.stat(self.path).st_size)
+            for key in removals:
+                del keys[key]
+            self._keys_signature = self._signature()
+            if self._dead_at is not None and self._dead_at_signature == before:
+                self._dead_pending |= removals
+                self._dead_at_signature = self._keys_signature
+            self._changed_attribute_indexes(before, [('remove', removals)])
 
     def replace(self, item, new_item):
-        item, new_item, text = str(item), str(new_item), self.path.read_text() 
-        if not self.textobjectcls.match(item) and self.textobjectcls.match(new_item):
-            raise ValueError(f'either {item} for {new_item} is not a {self.textobjectcls}')
-        self.path.write_text(text.replace(item, new_item))
+        self.batch(replace={str(item): new_item})
+
+    def batch(self, remove=(), replace=None):
+        """remove and replace many entries with a single pass over the file.
+        entries are compared by their text, ignoring surrounding whitespace,
+        and every occurance is removed or replaced. the file is rewritten
+        once, atomically
+
+        Args:
+            remove (iterable): the entries to remove
+            replace (dict): maps entries to the entries to replace them with
+
+        Raises:
+            ValueError: if an item is not a `textobjectcls` or is not in the file
+        """
+        with timing('textobjectfile.batch', list=self.path.stem) as event:
+            keys, dead, before = self._current_keys(), self._dead(), self._signature()
+            removals = {self._validated(item) for item in remove}
+            replacements = {self._validated(item): self._validated(new_item)
+                    for item, new_item in (replace or {}).items()}
+            found = set()
+            # the changes to report to the search index, see `SearchIndex.rewritten`
+            removed, moved, added = [], [], []
+            signature = filesignature(self.path)
+            temp = self.path.with_name(f'.{self.path.name}.tmp')
+            with mapped(self.path) as buffer, temp.open('wb') as out:
+                position = 0
+                for match in self.textobjectcls.matches(buffer):
+                    start, end = match.span()
+                    text = match.group(0).decode()
+                    key = _key(text)
+                    if dead and self.tombstones.is_dead(key, start):
+                        out.write(buffer[position:start])
+                        position = end + (buffer[end:end + 1] == b'\n')
+                    elif key in removals:
+                        out.write(buffer[position:start])
+                        position = end + (buffer[end:end + 1] == b'\n')
+                        found.add(key)
+                    elif key in replacements:
+                        out.write(buffer[position:start])
+                        leading = text[:len(text) - len(text.lstrip())]
+                        trailing = text[len(text.rstrip()):]
+                        replaced = f'{leading}{replacements[key]}{trailing}'
+                        added.append((out.tell(), replaced))
+                        out.write(replaced.encode())
+                        position = end
+                        found.add(key)
+                    else:
+                        continue
+                    removed.append(start)
+                    moved.append((position, out.tell() - position))
+                out.write(buffer[position:])
+                event.bytes = out.tell()
+            missing = (removals | set(replacements)) - found
+            if missing:
+                temp.unlink()
+                raise ValueError(f"{', '.join(sorted(missing))} not in {self.path}")
+            os.replace(temp, self.path)
+            self._rewritten()
+            if self.tombstones is not None:
+                self.tombstones.clear()
+            self._changed_attribute_indexes(before, [('remove', removals), ('replace', replacements)])
+            if self.search_index is not None:
+                self.search_index.rewritten(self, signature, removed, moved, added)
+            if keys is not None:
+                for key in removals:
+                    del keys[key]
+                for key, new_key in replacements.items():
+                    keys[new_key] += keys.pop(key, 0)
+                self._keys, self._keys_signature = keys, self._signature()
+
+    def apply(self, operations):
+        """apply a sequence of adds, removes and replaces in order, with
+        one read and one write of the file. an operation which fails
+        changes nothing and the operations after it are still applied
+
+        Args:
+            operations (iterable): (operation, items) pairs. operation is one
+                of 'add', 'remove' or 'replace'. items is a list of entries,
+                or for 'replace' a dict of entries to their replacements
+
+        Returns:
+            a list with None for each operation which succeeded or the
+            exception raised by each one which failed
+        """
+        with timing('textobjectfile.apply', list=self.path.stem) as event:
+            signature, before = filesignature(self.path), self._signature()
+            text = self.path.read_text()
+            head, segments, positions, position = None, [], {}, 0
+            # tombstones and the search index hold byte offsets, so count them alongside
+            dead, dead_segments, offset, offsets = self._dead(), [], 0, []
+            counting = dead or self.search_index is not None
+            for match in self.textobjectcls.matches(text):
+                start, end = match.span()
+                if segments:
+                    segments[-1][2] += text[position:start]
+                else:
+                    head = text[:start]
+                matched = match.group(0)
+                stripped = matched.strip()
+                leading = matched[:len(matched) - len(matched.lstrip())]
+                if counting:
+                    offset += len(text[position:start].encode())
+                    if dead and self.tombstones.is_dead(stripped, offset):
+                        dead_segments.append(len(segments))
+                    offsets.append(offset)
+                    offset += len(matched.encode())
+                if not dead_segments or dead_segments[-1] != len(segments):
+                    positions.setdefault(stripped, []).append(len(segments))
+                segments.append([stripped, leading, matched[len(matched.rstrip()):]])
+                position = end
+            if segments:
+                segments[-1][2] += text[position:]
+            else:
+                head = text
+            originals = [key for key, _, _ in segments]
+            for i in dead_segments:
+                segments[i] = None
+            # the operations which succeeded, with their items as keys
+            results, applied = [], []
+            for operation, items in operations:
+                try:
+                    if operation == 'add':
+                        added = [self._validated(item) for item in items]
+                        for key in added:
+                            positions.setdefault(key, []).append(len(segments))
+                            segments.append([key, '', '\n'])
+                        applied.append((operation, added))
+                    elif operation == 'remove':
+                        removals = {self._validated(item) for item in items}
+                        self._check_present(removals, positions)
+                        for key in removals:
+                            for i in positions.pop(key):
+                                segments[i] = None
+                        applied.append((operation, removals))
+                    elif operation == 'replace':
+                        replacements = {self._validated(item): self._validated(new_item)
+                                for item, new_item in items.items()}
+                        self._check_present(replacements, positions)
+                        moved = {key: positions.pop(key) for key in replacements}
+                        for key, indices in moved.items():
+                            for i in indices:
+                                segments[i][0] = replacements[key]
+                            positions.setdefault(replacements[key], []).extend(indices)
+                        applied.append((operation, replacements))
+                    else:
+                        raise ValueError(f'{operation} is not an operation')
+                except Exception as exception:
+                    results.append(exception)
+                else:
+                    results.append(None)
+            if applied:
+                temp = self.path.with_name(f'.{self.path.name}.tmp')
+                event.bytes = temp.write_text(head + ''.join(f'{leading}{key}{trailing}'
+                    for key, leading, trailing in filter(None, segments)))
+                os.replace(temp, self.path)
+                self._rewritten()
+                if self.tombstones is not None:
+                    self.tombstones.clear()
+                self._changed_attribute_indexes(before, applied)
+                if self.search_index is not None:
+                    self.search_index.rewritten(self, signature, *_changes(head, segments, originals, offsets))
+            return results
+
+    def index_attribute(self, attribute):
+        """keep a secondary index of the entries by an attribute, which
+        `query` uses for equality and prefix conditions on it. the index is
+        built on first use and kept up to date as entries are added,
+        removed and replaced"""
+        self.attribute_indexes.setdefault(attribute, AttributeIndex(attribute))
+
+    def query(self, *predicates, **conditions):
+        """the entries whose attributes satisfy every condition. conditions
+        are `attribute=value`, `attribute__prefix=value` or
+        `attribute__regex=pattern`, see `cap.store.query`
+
+        Returns:
+            a list of the matching entries
+        """
+        predicates = parse_conditions(*predicates, **conditions)
+        for predicate in predicates:
+            attribute_index = self.attribute_indexes.get(predicate.attribute)
+            if attribute_index is None:
+                continue
+            signature = self._signature()
+            if attribute_index.signature != signature:
+                attribute_index.build(self.entries(), signature)
+            candidates = predicate.lookup(attribute_index)
+            if candidates is not None:
+                return select(candidates, [p for p in predicates if p is not predicate])
+        return select(self.entries(lazy=True), predicates)
+
+    def _check_present(self, keys, positions):
+        missing = [key for key in keys if not positions.get(key)]
+        if missing:
+            raise ValueError(f"{', '.join(sorted(missing))} not in {self.path}")
+
+    def _validated(self, item):
+        """the key for an item, checking that it is a `textobjectcls`"""
+        text = str(item)
+        if not self.textobjectcls.valid(text):
+            raise ValueError(f"{item} is not a {self.textobjectcls}")
+        return _key(text)
+
+    def compact(self, threshold=None):
+        """rewrite the file without the entries removed with tombstones
+
+        Args:
+            threshold (float): only compact once at least this fraction of
+                the file is dead entries
+
+        Returns:
+            True if the file was compacted
+        """
+        if not self._dead() or (threshold is not None and self.dead_ratio() < threshold):
+            return False
+        with timing('textobjectfile.compact', list=self.path.stem):
+            self.batch()
+        return True
+
+    def dead_ratio(self):
+        """roughly what fraction of the file is entries removed with tombstones"""
+        if not self._dead():
+            return 0.0
+        return min(self.tombstones.dead_bytes / max(os.stat(self.path).st_size, 1), 1.0)
 
     def delete(self):
         """ delete the file"""
         self.path.unlink()
+        self._rewritten()
+        if self.tombstones is not None:
+            self.tombstones.clear()
+        for attribute_index in self.attribute_indexes.values():
+            attribute_index.invalidate()
+
+    def _counted(self):
+        """how many entries there are, dead or alive, from the index, the
+        snapshot or the cache, without the empty match at the end of the
+        file. None if the file has none of them"""
+        if self.index is not None:
+            spans = self.index.load()
+            return len(spans) // 2 - (len(spans) > 0 and spans[-1] == 0)
+        if self.snapshot is not None:
+            width = self.snapshot.width
+            with self.snapshot.spans() as (_, offsets):
+                return len(offsets) // width - (len(offsets) > 0 and offsets[-width] == offsets[1 - width])
+        if self.cache is not None:
+            entries = self.cache.entries(self.path, self.textobjectcls, self.snapshot)
+            return len(entries) - (len(entries) > 0 and not str(entries[-1]))
+
+    def _at(self, positions):
+        """the entries at positions among every entry, dead or alive"""
+        if self.index is not None:
+            spans = self.index.load()
+            return self._read_at([(spans[2 * i], spans[2 * i + 1]) for i in positions])
+        if self.snapshot is not None:
+            return self.snapshot.at(positions)
+        entries = self.cache.entries(self.path, self.textobjectcls, self.snapshot)
+        return [entries[i] for i in positions]
 
     def __len__(self):
-        return len(self.__iter__())
+        counted = self._counted()
+        if counted is not None:
+            return counted - len(self._dead_positions())
+        if self._dead():
+            return sum(1 for _ in without_end(self.entries(lazy=True)))
+        counted, empty = 0, False
+        with mapped(self.path) as buffer:
+            for match in self.textobjectcls.matches(buffer):
+                counted, empty = counted + 1, match.start() == match.end()
+        return counted - empty
     
     def __getitem__(self, key):
-        return self.__iter__()[key]
+        """get the entry at a position, or a list of entries for a slice.
+        with an index this is a seek to each entry, with a snapshot a read
+        of each entry's offsets, with a cache a lookup in the cached
+        entries, skipping the positions of dead entries. otherwise the file
+        is parsed up to the last entry requested"""
+        if self.index is not None or self.snapshot is not None or self.cache is not None:
+            positions = range(len(self))[key]
+            dead = self._dead_positions()
+            raw = [_alive_at(position, dead) if dead else position
+                    for position in (positions if isinstance(key, slice) else [positions])]
+            entries = self._at(raw)
+            return entries if isinstance(key, slice) else entries[0]
+        positions = range(len(self))[key]
+        if not isinstance(key, slice):
+            return next(islice(self.entries(), positions, None))
+        if not positions:
+            return []
+        first = min(positions)
+        entries = list(islice(self.entries(), first, max(positions) + 1))
+        return [entries[i - first] for i in positions]
     
     def __setitem__(self, key, value):
         item = self[key]
@@ -74,7 +666,7 @@ class TextObjectFile:
         return self.entries()
     
     def __contains__(self, item):
-        return item in self.__iter__()
+        return _key(item) in self.keys()
 
     def append(self, items):
         items = list(items)
@@ -89,7 +681,66 @@ class TextObjectFile:
         other = list(other)
         self.remove(*other)
         return self
-        
+
+
+def _changes(head, segments, originals, offsets):
+    """the entries `apply` removed, moved and added, as
+    `SearchIndex.rewritten` takes them
+
+    Args:
+        head (str): the text before the first entry
+        segments (list): [key, leading, trailing] for each entry written,
+            None for each entry removed
+        originals (list): the key of each entry before the operations
+        offsets (list): the old byte offset of each entry
+    """
+    removed, moved, added = [], [], []
+    new = len(head.encode())
+    for i, segment in enumerate(segments):
+        old = offsets[i] if i < len(offsets) else None
+        if segment is None:
+            if old is not None:
+                removed.append(old)
+            continue
+        key, leading, trailing = segment
+        written = f'{leading}{key}{trailing}'
+        if old is not None and key == originals[i]:
+            if not moved or moved[-1][1] != new - old:
+                moved.append((old, new - old))
+        else:
+            if old is not None:
+                removed.append(old)
+            added.append((new, written))
+        new += len(written.encode())
+    return removed, moved, added
+
+
+def without_end(entries):
+    """the entries without the empty match a regex which matches empty
+    text makes at the end of a file"""
+    entries = iter(entries)
+    last = next(entries, None)
+    for entry in entries:
+        yield last
+        last = entry
+    if last is not None and str(last):
+        yield last
+
+
+def _alive_at(position, dead):
+    """the position among every entry of the live entry at `position`,
+    given the sorted positions of the dead entries"""
+    raw = position
+    while (shifted := position + bisect_right(dead, raw)) != raw:
+        raw = shifted
+    return raw
+
+
+def _key(text):
+    """entries are compared by their text without surrounding whitespace"""
+    return str(text).strip()
+
+
 @constructed_text_object('$path $textobjcls')
 class TextObjectFileGroupEntry:
     def transform(txtobj):
@@ -105,8 +756,14 @@ class TextObjectFileGroupEntry:
 
 
 class TextObjectFileGroup:
-    def __init__(self, path):
-        self.file = TextObjectFile(path, TextObjectFileGroupEntry)
+    def __init__(self, path, cache=None, search_index=None, tombstones=False, snapshot=False,
+            index=False):
+        self.cache = cache
+        self.search_index = search_index
+        self.tombstones = tombstones
+        self.snapshot = snapshot
+        self.index = index
+        self.file = TextObjectFile(path, TextObjectFileGroupEntry, cache=cache)
     
     def add(self, *textobjectfiles):
         """add a TextObjectFile to the group
@@ -114,8 +771,9 @@ class TextObjectFileGroup:
         Args:
             textobjectfile (:obj: TextObjectFile) the TextObjectFile to add to the group
         """
-        self.file.add(*[TextObjectFileGroupEntry(textobjectfile.path, textobjectfile.textobjectcls) 
-            for textobjectfile in textobjectfiles])
+        with timing('group.add', group=self.file.path.stem):
+            self.file.add(*[TextObjectFileGroupEntry(textobjectfile.path, textobjectfile.textobjectcls) 
+                for textobjectfile in textobjectfiles])
 
     def remove(self, *textobjectfiles):
         """remove a file from the registry
@@ -123,8 +781,9 @@ class TextObjectFileGroup:
         Args:
             filepath(:obj: pathlib.Path) the path to the file to be removed
         """
-        self.file.remove(*[TextObjectFileGroupEntry(textobjfile.path, textobjfile.textobjectcls) 
-            for textobjfile in textobjectfiles])
+        with timing('group.remove', group=self.file.path.stem):
+            self.file.remove(*[TextObjectFileGroupEntry(textobjfile.path, textobjfile.textobjectcls) 
+                for textobjfile in textobjectfiles])
 
     def delete(self, *textobjectfiles):
         """completly delete a TextObjectFile
@@ -132,27 +791,52 @@ class TextObjectFileGroup:
         Args: 
             *textobjectfiles (:obj: TextObjectFile): the text object files to delete
         """
-        for textobjectfile in textobjectfiles:
-            textobjectfile.delete()
-            self.remove(textobjectfile)
+        with timing('group.delete', group=self.file.path.stem):
+            for textobjectfile in textobjectfiles:
+                textobjectfile.delete()
+                self.remove(textobjectfile)
 
     def files_by_name(self):
         return {tof.path.with_suffix('').name:tof for tof in self}
 
     def __len__(self):
-        return len(self.__iter__())
+        return len(self.file)
 
     def __getitem__(self, key):
-        return self.files_by_name()[key]
+        with timing('group.lookup', group=self.file.path.stem):
+            return self.files_by_name()[key]
     
     def __iter__(self):
-        return iter([TextObjectFile(entry.path, entry.textobjcls) for entry in self.file.entries()])
+        return iter([open_textobjectfile(entry.path, entry.textobjcls, cache=self.cache,
+            search_index=self.search_index, tombstones=self.tombstones, snapshot=self.snapshot,
+            index=self.index)
+            for entry in self.file.entries()])
     
     def __contains__(self, item):
-        return str(item) in self.file.entries() or str(item) in self.files_by_name()
+        return item in self.file or str(item) in self.files_by_name()
 
-    def entries(self):
-        for textobjfile in self.files_in_group():
-            yield from textobjfile.entries()
+    def query(self, *predicates, **conditions):
+        """the entries of every file in the group which satisfy the
+        conditions, see `TextObjectFile.query`"""
+        return [entry for textobjfile in self for entry in textobjfile.query(*predicates, **conditions)]
+
+    def entries(self, ordered=True, workers=None, processes=False):
+        """iterate the entries of every file in the group. the files are
+        read and parsed concurrently so the group takes about as long to
+        read as its slowest file
+
+        Args:
+            ordered (bool): yield the entries file by file in the order of
+                the group, otherwise yield each file's entries as soon as
+                it has been read
+            workers (int): how many files to read at once
+            processes (bool): parse in a process pool instead of threads,
+                for types with expensive regexes
+
+        Yields:
+            the entries of the files in the group
+        """
+        for _, entries in read_files(self, ordered, workers, processes):
+            yield from entries
 
 
@@ -1,11 +1,12 @@
 from abc import ABC, abstractmethod, abstractproperty
 from functools import wraps
 from inspect import signature
-from createhook import hooks
+from cap.metrics import timing, timed
 import re
 
 class TextObject(ABC):
     """An object which can be represented in plain text"""
+    __slots__ = ()
 
     @abstractmethod
     def __str__(self):
@@ -39,6 +40,21 @@ class TextObject(ABC):
             an instance of `text_object` if the text matches, otherwise None
         """
 
+    @classmethod
+    def valid(cls, text):
+        """whether the text is a `text_object`, without creating one
+
+        Args:
+            text (str): The text to check
+
+        Returns:
+            True if `match` would succeed, otherwise False
+        """
+        try:
+            return bool(cls.match(text))
+        except ValueError:
+            return False
+
     @classmethod
     @abstractmethod
     def search(self, text):
@@ -75,6 +91,16 @@ class RegexTextObject(TextObject):
     def __init_subclass__(cls, regex, flags=[re.MULTILINE],  **kwargs):
         super.__init_subclass__(**kwargs)
         cls.regex = re.compile(regex, *flags)
+        cls._bytesregex = None
+        cls.prefilter = prefilter(cls.regex)
+
+    @classmethod
+    def bytesregex(cls):
+        """the regex for this RegexTextObject compiled for bytes, used
+        to search memory mapped files. compiled on first use"""
+        if cls._bytesregex is None:
+            cls._bytesregex = bytes_regex(cls.regex)
+        return cls._bytesregex
 
     def __init__(self, text=None,  match=None):
         if not match:
@@ -110,6 +136,10 @@ class RegexTextObject(TextObject):
         if not match: raise ValueError(f"{text} is not a valid {cls}")
         return cls._from_match(match)
 
+    @classmethod
+    def valid(cls, text):
+        return cls.regex.match(text) is not None
+
     @classmethod
     def search(cls, text):
         """search for a match to the regex for this RegexTextObject 
@@ -125,17 +155,262 @@ class RegexTextObject(TextObject):
             if `include_match_object` is True the return will be a tuple 
             (MatchObject, RegexTextObject)
         """
-        match = cls.regex.search(text)
-        if match:
-            return cls._from_match(match)
+        with timing('parse.search', type=cls.__name__) as event:
+            event.bytes = len(text)
+            match = next(cls._finditer(cls.regex, text), None)
+            if match:
+                return cls._from_match(match)
 
     @classmethod
     def findall(cls, text):
         """find all matches of the regex for this RegexTextObject and
         return an instance for each found"""
-        matches = cls.regex.finditer(text)
-        if not matches: raise ValueError(f"there were no matches in the given text")
-        return [cls._from_match(m) for m in matches]
+        with timing('parse.findall', type=cls.__name__) as event:
+            event.bytes = len(text)
+            matches = cls._finditer(cls.regex, text)
+            if not matches: raise ValueError(f"there were no matches in the given text")
+            return [cls._from_match(m) for m in matches]
+
+    @classmethod
+    def finditer(cls, text, pos=0):
+        """lazily find all matches of the regex for this RegexTextObject,
+        yielding an instance for each as it is found
+
+        Args:
+            text (str, bytes, mmap.mmap): the text to search. bytes-like text
+                is searched with `bytesregex` and decoded one match at a time,
+                so a memory mapped file never has to be read into memory
+            pos (int): where in the text to start searching
+
+        Yields:
+            instances of this RegexTextObject
+        """
+        return timed(cls._instances(text, pos), 'parse.finditer', bytes=len(text) - pos, type=cls.__name__)
+
+    @classmethod
+    def _instances(cls, text, pos):
+        if isinstance(text, str):
+            for match in cls._finditer(cls.regex, text, pos):
+                yield cls._from_match(match)
+        else:
+            for match in cls._finditer(cls.bytesregex(), text, pos):
+                yield cls._from_match(DecodedMatch(match))
+
+    @classmethod
+    def records(cls, text, pos=0):
+        """like `finditer` but yields compact `TextObjectRecord`s, which
+        only create the full object when its attributes are used
+
+        Args:
+            text (str, bytes, mmap.mmap): the text to search. records from
+                a str hold a reference to it, records from bytes-like text
+                copy out the bytes of their match
+            pos (int): where in the text to start searching
+
+        Yields:
+            a `TextObjectRecord` for each match
+        """
+        return timed(cls._records(text, pos), 'parse.records', bytes=len(text) - pos, type=cls.__name__)
+
+    @classmethod
+    def _records(cls, text, pos):
+        if isinstance(text, str):
+            for match in cls._finditer(cls.regex, text, pos):
+                yield TextObjectRecord(cls, text, *match.span())
+        else:
+            for match in cls._finditer(cls.bytesregex(), text, pos):
+                matched = match.group(0)
+                yield TextObjectRecord(cls, matched, 0, len(matched))
+
+    @classmethod
+    def matches(cls, text, pos=0):
+        """like `finditer` but yields the `re.Match` objects, without
+        creating instances. bytes-like text is searched with `bytesregex`"""
+        regex = cls.regex if isinstance(text, str) else cls.bytesregex()
+        return timed(cls._finditer(regex, text, pos), 'parse.matches', bytes=len(text) - pos,
+                type=cls.__name__)
+
+    @classmethod
+    def _finditer(cls, regex, text, pos=0):
+        """`regex.finditer`, jumping between occurances of `prefilter`,
+        see `prefiltered_finditer`"""
+        return prefiltered_finditer(regex, text, pos, cls.prefilter)
+
+
+class TextObjectRecord(TextObject):
+    """A compact stand in for an instance of a RegexTextObject, holding
+    only the buffer it was found in and its span. The text is sliced from
+    the buffer when needed, the full object (its groups and
+    transformations) is created the first time any other attribute
+    is accessed
+
+    Args:
+        textobjectcls (class): the RegexTextObject this is a record of
+        buffer (str, bytes): the text the record was found in
+        start (int): where the record starts in the buffer
+        end (int): where the record ends in the buffer
+    """
+    __slots__ = ('textobjectcls', 'buffer', 'start', 'end', '_textobject')
+
+    def __init__(self, textobjectcls, buffer, start, end):
+        self.textobjectcls = textobjectcls
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self._textobject = None
+
+    def __str__(self):
+        text = self.buffer[self.start:self.end]
+        return text if isinstance(text, str) else text.decode()
+
+    def textobject(self):
+        """the full `textobjectcls` instance, created on first use"""
+        if self._textobject is None:
+            cls = self.textobjectcls
+            if isinstance(self.buffer, str):
+                match = cls.regex.match(self.buffer, self.start)
+            else:
+                match = DecodedMatch(cls.bytesregex().match(self.buffer, self.start))
+            self._textobject = cls._from_match(match)
+        return self._textobject
+
+    @property
+    def text(self):
+        return str(self)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.textobject(), name)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.textobjectcls.__name__}, {str(self)!r})'
+
+    @classmethod
+    def match(cls, text):
+        raise TypeError('records are created with RegexTextObject.records')
+
+    search = findall = match
+
+
+class DecodedMatch:
+    """A match over bytes, decoded to str so that it can stand in for
+    the `re.Match` passed to `RegexTextObject`. The groups are decoded
+    up front so the match stays valid once the buffer is closed,
+    `span` keeps the byte offsets into the original buffer
+
+    Args:
+        match (:obj: re.Match): a match from a bytes pattern
+    """
+    def __init__(self, match):
+        self._span = match.span()
+        self._groups = tuple(_decode(g) for g in match.groups())
+        self._groupdict = {k:_decode(v) for k,v in match.groupdict().items()}
+        self._text = match.group(0).decode()
+
+    def span(self):
+        return self._span
+
+    def group(self, group=0):
+        if isinstance(group, str):
+            return self._groupdict[group]
+        return self._text if group == 0 else self._groups[group - 1]
+
+    def groups(self):
+        return self._groups
+
+    def groupdict(self):
+        return dict(self._groupdict)
+
+class SpanMatch(DecodedMatch):
+    """A match made from stored byte offsets rather than by a regex, such
+    as the offsets in a `Snapshot` or those sent back by a parsing worker.
+    Like a DecodedMatch it can stand in for the `re.Match` passed to
+    `RegexTextObject`
+
+    Args:
+        text (str, bytes, mmap.mmap): the text of the file, bytes are decoded.
+            a str must be ascii, so that its offsets are byte offsets
+        row (list): the start and end of the match and of each of its groups,
+            -1 for a group which didn't match
+        groupindex (dict): the regex's group numbers by name
+    """
+    def __init__(self, text, row, groupindex):
+        decode = not isinstance(text, str)
+        groups = []
+        for i in range(2, len(row), 2):
+            start, end = row[i], row[i + 1]
+            group = None if start < 0 else text[start:end]
+            groups.append(group.decode() if decode and group is not None else group)
+        self._span = (row[0], row[1])
+        self._text = text[row[0]:row[1]].decode() if decode else text[row[0]:row[1]]
+        self._groups = tuple(groups)
+        self._groupdict = {name: groups[number - 1] for name, number in groupindex.items()}
+
+def _decode(value):
+    return value if value is None else value.decode()
+
+REGEX_SPECIAL = set('.^$*+?{}[]()|\\')
+QUANTIFIERS = set('*+?{')
+
+def literal_prefix(regex):
+    """the literal text which every match of a regex starts with
+
+    Args:
+        regex (:obj: re.Pattern): a compiled regex
+
+    Returns:
+        the prefix, or '' if matches do not start with a known literal
+    """
+    pattern = regex.pattern
+    if regex.flags & (re.IGNORECASE | re.VERBOSE) or '|' in pattern:
+        return ''
+    chars, i = [], 1 if pattern.startswith('^') else 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            if i + 1 == len(pattern) or pattern[i + 1].isalnum():
+                break
+            char, i = pattern[i + 1], i + 1
+        elif char in REGEX_SPECIAL:
+            if char in QUANTIFIERS and chars:
+                chars.pop()
+            break
+        chars.append(char)
+        i += 1
+    return ''.join(chars)
+
+def prefilter(regex):
+    """the literal to jump between when searching with a regex, or ''
+
+    re already skips ahead to a literal the pattern starts with, but not
+    to one which follows a ^ anchor
+    """
+    return literal_prefix(regex) if regex.pattern.startswith('^') else ''
+
+def bytes_regex(regex):
+    """a str regex compiled for searching bytes"""
+    return re.compile(regex.pattern.encode(), regex.flags & ~re.UNICODE)
+
+def prefiltered_finditer(regex, text, pos=0, prefilter=''):
+    """`regex.finditer`, but when every match starts with the literal
+    `prefilter` jump between occurances of it with `find` and only try
+    the regex there, rather than at every position in the text"""
+    if not prefilter:
+        yield from regex.finditer(text, pos)
+        return
+    prefix = prefilter if isinstance(text, str) else prefilter.encode()
+    find = text.find
+    while True:
+        pos = find(prefix, pos)
+        if pos < 0:
+            return
+        match = regex.match(text, pos)
+        if match:
+            yield match
+            pos = max(match.end(), pos + 1)
+        else:
+            pos += 1
 
 def textobject(name, template):
     """create a RegexTextObject subclass based on 
@@ -0,0 +1,85 @@
+from pathlib import Path
+import json
+import os
+
+
+class Tombstones:
+    """A sidecar to a TextObjectFile recording entries which were removed
+    without rewriting the file
+
+    The sidecar is kept next to the file as `.<name>.tomb`, one JSON record
+    `[size, bytes, key]` per removal. A record kills every entry with the
+    key which starts before `size`, the size of the file when it was
+    removed, so the same entry added again afterwards is alive. `bytes` is
+    roughly how much of the file the dead entries take up.
+
+    Args:
+        path (:obj: pathlib.Path): the path to the file the entries are in
+    """
+    def __init__(self, path):
+        self.textpath = Path(path)
+        self.path = self.textpath.with_name(f'.{self.textpath.name}.tomb')
+        self.dead = {}
+        self.dead_bytes = 0
+        self.signature = None
+
+    def stat(self):
+        """the (inode, size, mtime) of the sidecar, or None if there is none"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def load(self):
+        """read the sidecar if it changed since it was last read
+
+        Returns:
+            a dict of the keys of dead entries to the offset before which
+            entries with the key are dead
+        """
+        signature = self.stat()
+        if signature == self.signature:
+            return self.dead
+        self.dead, self.dead_bytes = {}, 0
+        if signature is not None:
+            with self.path.open() as f:
+                for line in f:
+                    self._record(*json.loads(line))
+        self.signature = signature
+        return self.dead
+
+    def _record(self, size, dead_bytes, key):
+        self.dead[key] = max(self.dead.get(key, 0), size)
+        self.dead_bytes += dead_bytes
+
+    def add(self, removals, size):
+        """record removals
+
+        Args:
+            removals (iterable): (key, bytes) of each removed entry
+            size (int): the size of the file
+        """
+        current = self.stat() == self.signature
+        removals = list(removals)
+        with self.path.open('a') as f:
+            f.write(''.join(json.dumps([size, dead_bytes, key]) + '\n'
+                for key, dead_bytes in removals))
+        if current:
+            for key, dead_bytes in removals:
+                self._record(size, dead_bytes, key)
+            self.signature = self.stat()
+
+    def is_dead(self, key, offset):
+        return self.dead.get(key, -1) > offset
+
+    def clear(self):
+        """forget every removal, once the file has been compacted"""
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+        self.dead, self.dead_bytes, self.signature = {}, 0, None
+
+    def __len__(self):
+        return len(self.load())
@@ -1 +1,5 @@
-from cap.taskserver.app import start
+def start():
+    """start the flask taskserver. flask is only imported here, so the
+    asyncio server can be used without it"""
+    from cap.taskserver.app import start
+    start()
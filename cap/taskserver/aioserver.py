@@ -0,0 +1,341 @@
+"""An asyncio version of the taskserver
+
+Each list has its own lock, so requests for different lists run in
+parallel while the writes to a list never interleave. Writes which arrive
+for a list while it is busy are queued and applied together once it is
+free: queued adds become one append, queued removes and replaces are
+applied in order with one rewrite of the file and each gets its own
+result.
+"""
+from itertools import groupby
+from contextlib import AsyncExitStack
+from urllib.parse import urlsplit, parse_qsl, unquote
+from http import HTTPStatus
+from cap.lists.lists import main_list_set as lists
+from cap.taskserver.batch import run_batch, ITEM_OPERATIONS
+from cap.taskserver.listing import validators, not_modified, page, ndjson, query, search, NOT_MODIFIED, NDJSON
+from cap.metrics import collector, CONTENT_TYPE
+from cap.store.backends import DEFAULT_BACKEND
+from cap.taskserver.compaction import COMPACT_INTERVAL, DEAD_RATIO, logger
+import asyncio
+import json
+import re
+
+BAD_REQUEST = 400
+NOT_FOUND = 404
+
+routes = []
+collector.install()
+
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        url = urlsplit(target)
+        self.method = method
+        self.path = unquote(url.path)
+        self.args = dict(parse_qsl(url.query))
+        self.headers = headers
+        self.body = body
+
+    def get_json(self):
+        return json.loads(self.body)
+
+
+def route(method, rule):
+    """register a coroutine to handle requests to `rule`, where `<name>`
+    matches one path segment and is passed as a keyword argument"""
+    pattern = re.compile(re.sub(r'<(\w+)>', r'(?P<\g<1>>[^/]+)', rule) + '$')
+    def register(handler):
+        routes.append((method, pattern, handler))
+        return handler
+    return register
+
+
+class Write:
+    """a write to a list waiting to be applied"""
+    def __init__(self, operation, items):
+        self.operation = operation
+        self.items = items
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class ListWriter:
+    """serializes the writes to one list, coalescing those which queue up"""
+    def __init__(self, list_name):
+        self.list_name = list_name
+        self.lock = asyncio.Lock()
+        self.pending = []
+
+    async def submit(self, operation, items):
+        write = Write(operation, items)
+        self.pending.append(write)
+        async with self.lock:
+            if self.pending:
+                writes, self.pending = self.pending, []
+                loop = asyncio.get_running_loop()
+                results = await loop.run_in_executor(None, apply_writes, self.list_name, writes)
+                for queued, exception in zip(writes, results):
+                    if exception is None:
+                        queued.future.set_result(None)
+                    else:
+                        queued.future.set_exception(exception)
+        await write.future
+
+
+def apply_writes(list_name, writes):
+    """apply queued writes to a list in order. consecutive adds are applied
+    as one append, if it fails they are retried one at a time to find the
+    failure. consecutive removes and replaces are applied with
+    `TextObjectFile.apply`, which reports each one's own result, or one
+    at a time when they are all removes from a list with tombstones
+
+    Returns:
+        the exception raised by each write, or None if it succeeded
+    """
+    results = []
+    try:
+        textobjectfile = lists[list_name]
+    except Exception as exception:
+        return [exception for _ in writes]
+    for adding, run in groupby(writes, key=lambda w: w.operation == 'add'):
+        run = list(run)
+        if adding:
+            results.extend(_append(textobjectfile, run))
+        elif getattr(textobjectfile, 'tombstones', None) is not None and all(
+                write.operation == 'remove' for write in run):
+            results.extend(_outcome(textobjectfile.remove, *write.items) for write in run)
+        else:
+            try:
+                results.extend(textobjectfile.apply([(write.operation, write.items) for write in run]))
+            except Exception as exception:
+                results.extend(exception for _ in run)
+    return results
+
+
+def _append(textobjectfile, writes):
+    """add the items of every write at once, an add which fails writes
+    nothing so they are then retried one at a time"""
+    exception = _outcome(textobjectfile.add, *[item for write in writes for item in write.items])
+    if exception is None or len(writes) == 1:
+        return [exception for _ in writes]
+    return [_outcome(textobjectfile.add, *write.items) for write in writes]
+
+
+def _outcome(function, *args):
+    """the exception raised by calling `function`, or None"""
+    try:
+        function(*args)
+    except Exception as exception:
+        return exception
+
+
+writers = {}
+index_lock = asyncio.Lock()
+
+
+def list_writer(list_name):
+    return writers.get(list_name) or writers.setdefault(list_name, ListWriter(list_name))
+
+
+async def write(list_name, operation, items):
+    await list_writer(list_name).submit(operation, items)
+
+
+async def in_thread(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+@route('POST', '/create/<textobjtype>/<list_name>')
+async def create(request, textobjtype, list_name):
+    async with index_lock:
+        await in_thread(lists.add, list_name, textobjtype, request.args.get('backend', DEFAULT_BACKEND))
+    return f'added list {list_name} of type {textobjtype}'
+
+
+@route('POST', '/delete/<list_name>')
+async def delete(request, list_name):
+    async with index_lock, list_writer(list_name).lock:
+        await in_thread(lists.__delitem__, list_name)
+        writers.pop(list_name, None)
+    return f"{list_name} was deleted"
+
+
+@route('POST', '/add/<list_name>')
+async def addto(request, list_name):
+    items = request.get_json()['items']
+    await write(list_name, 'add', items)
+    return f"{items} were added to {list_name}"
+
+
+@route('POST', '/remove/<list_name>')
+async def removefrom(request, list_name):
+    items = request.get_json()['items']
+    await write(list_name, 'remove', items)
+    return f"{items} were removed from {list_name}"
+
+
+@route('POST', '/replace/<list_name>')
+async def replace_in(request, list_name):
+    items = request.get_json()
+    await write(list_name, 'replace', items)
+    return f"{list(items)} were replaced in {list_name}"
+
+
+@route('POST', '/batch')
+async def batch(request):
+    operations = request.get_json()['operations']
+    async with AsyncExitStack() as locks:
+        if any(op.get('op') not in ITEM_OPERATIONS for op in operations):
+            await locks.enter_async_context(index_lock)
+        for list_name in sorted({str(op.get('list')) for op in operations}):
+            await locks.enter_async_context(list_writer(list_name).lock)
+        return {'results': await in_thread(run_batch, lists, operations)}
+
+
+@route('GET', '/list/<list_name>')
+async def read(request, list_name):
+    if list_name not in lists.by_name():
+        return f'{list_name} is not a list', NOT_FOUND
+    textobjectfile = lists[list_name]
+    headers = validators(textobjectfile)
+    if not_modified(request.headers.get('if-none-match'), headers['ETag']):
+        return '', NOT_MODIFIED, headers
+    if request.args.get('format') == 'ndjson':
+        headers['Content-Type'] = NDJSON
+        return ndjson(textobjectfile), 200, headers
+    body = await in_thread(page, textobjectfile, request.args.get('offset', 0), request.args.get('limit'))
+    return body, 200, headers
+
+
+@route('GET', '/query')
+async def query_lists(request):
+    return await in_thread(query, lists, request.args)
+
+
+@route('GET', '/search')
+async def search_lists(request):
+    return await in_thread(search, lists, request.args)
+
+
+@route('GET', '/metrics')
+async def metrics(request):
+    return collector.render(), 200, {'Content-Type': CONTENT_TYPE}
+
+
+async def dispatch(request):
+    """run the handler for a request
+
+    Returns:
+        a (status, headers, body) tuple
+    """
+    for method, pattern, handler in routes:
+        match = pattern.match(request.path)
+        if match and method == request.method:
+            try:
+                response = await handler(request, **match.groupdict())
+            except Exception as exception:
+                response = (str(exception.args), BAD_REQUEST)
+            break
+    else:
+        response = ('not found', NOT_FOUND)
+    if not isinstance(response, tuple):
+        response = (response, 200)
+    body, status, *headers = response
+    headers = dict(*headers)
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body)
+        headers.setdefault('Content-Type', 'application/json')
+    headers.setdefault('Content-Type', 'text/plain; charset=utf-8')
+    return status, headers, body
+
+
+async def handle(reader, writer):
+    """serve the requests on one connection, keeping it alive between them"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, target, version = request_line.decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, response_headers, response_body = await dispatch(
+                    Request(method, target, headers, body))
+            await respond(writer, status, response_headers, response_body)
+            if headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0':
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def respond(writer, status, headers, body):
+    """write a response. a body which is neither str nor bytes is an
+    iterator of chunks, which are produced in a thread and sent with
+    chunked transfer encoding"""
+    streamed = not isinstance(body, (str, bytes))
+    if streamed:
+        headers['Transfer-Encoding'] = 'chunked'
+    else:
+        body = body.encode() if isinstance(body, str) else body
+        headers['Content-Length'] = str(len(body))
+    head = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}']
+    head.extend(f'{name}: {value}' for name, value in headers.items())
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+    if not streamed:
+        writer.write(body)
+        await writer.drain()
+        return
+    while (chunk := await in_thread(next, body, None)) is not None:
+        chunk = chunk.encode() if isinstance(chunk, str) else chunk
+        writer.write(f'{len(chunk):x}\r\n'.encode() + chunk + b'\r\n')
+        await writer.drain()
+    writer.write(b'0\r\n\r\n')
+    await writer.drain()
+
+
+async def compactor(interval=COMPACT_INTERVAL, threshold=DEAD_RATIO):
+    """compact the lists whose removed entries pass `threshold` every
+    `interval` seconds, holding each list's lock while it is rewritten.
+    the lists are read in a thread, and an error is logged without
+    stopping the compaction of the other lists"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            files = list((await in_thread(lists.by_name)).items())
+        except Exception:
+            logger.exception('could not read the lists to compact')
+            continue
+        for list_name, textobjectfile in files:
+            try:
+                if await in_thread(textobjectfile.dead_ratio) < threshold:
+                    continue
+                async with list_writer(list_name).lock:
+                    await in_thread(textobjectfile.compact, threshold)
+            except Exception:
+                logger.exception(f'could not compact {list_name}')
+
+
+async def serve(host='127.0.0.1', port=5000):
+    server = await asyncio.start_server(handle, host, port)
+    compacting = asyncio.create_task(compactor())
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            compacting.cancel()
+
+
+def start(host='127.0.0.1', port=5000):
+    asyncio.run(serve(host, port))
+
+
+if __name__ == '__main__':
+    start()
@@ -1,13 +1,24 @@
-from flask import Flask, request, make_response, jsonify
+from flask import Flask, Response, request, make_response, jsonify
 from pathlib import Path
 from cap.store.textobjectfiles import TextObjectFile, TextObjectFileGroup
 from cap.store.textobjects import TextObject, RegexTextObject, Line
 from cap.lists.lists import main_list_set as lists
+from cap.taskserver.batch import run_batch
+from cap.taskserver.listing import validators, not_modified, page, ndjson, query, search, NOT_MODIFIED, NDJSON
+from cap.metrics import collector, CONTENT_TYPE
+from cap.store.backends import DEFAULT_BACKEND
+from cap.taskserver.compaction import compact_in_background
 from cap import plugins
 from functools import wraps
+from threading import Lock
 
 app = Flask(__name__)
+collector.install()
 BAD_REQUEST = 400
+NOT_FOUND = 404
+# held while writing to the lists, so that background compaction
+# never rewrites a list while a request is writing to it
+writing = Lock()
 
 def tryexceptbadrequest(operation):
     @wraps(operation)
@@ -18,20 +29,30 @@ def tryexceptbadrequest(operation):
                 return(str(exception.args), BAD_REQUEST)
     return trying
 
+def locked(operation):
+    @wraps(operation)
+    def holding(*args, **kwargs):
+        with writing:
+            return operation(*args, **kwargs)
+    return holding
+
 @app.route('/create/<textobjtype>/<list_name>', methods=['POST'])
 @tryexceptbadrequest
+@locked
 def create(textobjtype, list_name):
-    lists.add(list_name, textobjtype)
+    lists.add(list_name, textobjtype, request.args.get('backend', DEFAULT_BACKEND))
     return f'added list {list_name} of type {textobjtype}'
 
 @app.route('/delete/<list_name>', methods=['POST'])
 @tryexceptbadrequest
+@locked
 def delete(list_name):
     del lists[list_name]
     return f"{list_name} was deleted"
 
 @app.route('/add/<list_name>', methods = ['POST'])
 @tryexceptbadrequest
+@locked
 def addto(list_name):
     items = request.get_json()['items']
     lists[list_name].add(*items)
@@ -39,6 +60,7 @@ def addto(list_name):
 
 @app.route('/remove/<list_name>', methods=['POST'])
 @tryexceptbadrequest
+@locked
 def removefrom(list_name):
     items = request.get_json()['items']
     lists[list_name].remove(*items)
@@ -46,11 +68,49 @@ def removefrom(list_name):
 
 @app.route('/replace/<list_name>', methods=['POST'])
 @tryexceptbadrequest
+@locked
 def replace_in(list_name):
     items = request.get_json()
-    for item, repl in items.items():
-        lists[list_name].replace(item, repl)
+    lists[list_name].batch(replace=items)
+    return f"{list(items)} were replaced in {list_name}"
+
+@app.route('/batch', methods=['POST'])
+@tryexceptbadrequest
+@locked
+def batch():
+    operations = request.get_json()['operations']
+    return jsonify(results=run_batch(lists, operations))
+
+@app.route('/list/<list_name>', methods=['GET'])
+@tryexceptbadrequest
+def read(list_name):
+    if list_name not in lists.by_name():
+        return f'{list_name} is not a list', NOT_FOUND
+    textobjectfile = lists[list_name]
+    headers = validators(textobjectfile)
+    if not_modified(request.headers.get('If-None-Match'), headers['ETag']):
+        return '', NOT_MODIFIED, headers
+    if request.args.get('format') == 'ndjson':
+        return Response(ndjson(textobjectfile), mimetype=NDJSON, headers=headers)
+    response = jsonify(page(textobjectfile, request.args.get('offset', 0), request.args.get('limit')))
+    response.headers.update(headers)
+    return response
+
+@app.route('/query', methods=['GET'])
+@tryexceptbadrequest
+def query_lists():
+    return jsonify(query(lists, request.args.to_dict()))
+
+@app.route('/search', methods=['GET'])
+@tryexceptbadrequest
+def search_lists():
+    return jsonify(search(lists, request.args.to_dict()))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(collector.render(), content_type=CONTENT_TYPE)
 
 def start():
+    compact_in_background(lists, writing)
     app.run()
 
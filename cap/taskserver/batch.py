@@ -0,0 +1,70 @@
+"""Apply many operations across many lists in one request
+
+An operation is a dict with an `op` and a `list`:
+
+    {'op': 'create', 'list': name, 'type': textobjtype, 'backend': 'text'}
+    {'op': 'delete', 'list': name}
+    {'op': 'add', 'list': name, 'items': [...]}
+    {'op': 'remove', 'list': name, 'items': [...]}
+    {'op': 'replace', 'list': name, 'items': {item: replacement}}
+
+The adds, removes and replaces for each list are grouped and applied with
+`TextObjectFile.apply`, so each list is read and written once. They keep
+their order within the list, and creating or deleting a list applies the
+operations queued for it first.
+"""
+from cap.store.backends import DEFAULT_BACKEND
+
+ITEM_OPERATIONS = ('add', 'remove', 'replace')
+
+
+def run_batch(lists, operations):
+    """apply a batch of operations to a ListSet
+
+    Args:
+        lists (:obj: ListSet): the lists to operate on
+        operations (list): the operations, as described above
+
+    Returns:
+        a result for each operation, {'ok': True} or {'ok': False, 'error': message}
+    """
+    results = [None] * len(operations)
+    pending = {}
+
+    def flush(list_name):
+        queued = pending.pop(list_name, [])
+        if not queued:
+            return
+        try:
+            outcomes = lists[list_name].apply([(op['op'], op.get('items', [])) for _, op in queued])
+        except Exception as exception:
+            outcomes = [exception] * len(queued)
+        for (i, _), outcome in zip(queued, outcomes):
+            results[i] = _result(outcome)
+
+    for i, op in enumerate(operations):
+        list_name = op.get('list')
+        if op.get('op') in ITEM_OPERATIONS:
+            pending.setdefault(list_name, []).append((i, op))
+            continue
+        flush(list_name)
+        try:
+            if op.get('op') == 'create':
+                lists.add(list_name, op['type'], op.get('backend', DEFAULT_BACKEND))
+            elif op.get('op') == 'delete':
+                del lists[list_name]
+            else:
+                raise ValueError(f"{op.get('op')} is not an operation")
+        except Exception as exception:
+            results[i] = _result(exception)
+        else:
+            results[i] = _result(None)
+    for list_name in list(pending):
+        flush(list_name)
+    return results
+
+
+def _result(exception):
+    if exception is None:
+        return {'ok': True}
+    return {'ok': False, 'error': str(exception.args)}
@@ -0,0 +1,46 @@
+"""Compact the lists of a taskserver in the background
+
+Removing entries from a list opened with tombstones only records them as
+dead, and the file is rewritten without them once enough of it is dead.
+An error compacting a list is logged and the other lists are still
+compacted, as are the lists on the next round.
+"""
+from threading import Thread
+import logging
+import time
+
+COMPACT_INTERVAL = 60
+DEAD_RATIO = 0.25
+
+logger = logging.getLogger(__name__)
+
+
+def compact_in_background(lists, lock, interval=COMPACT_INTERVAL, threshold=DEAD_RATIO):
+    """compact the lists whose removed entries pass `threshold` every
+    `interval` seconds, in a daemon thread
+
+    Args:
+        lists (:obj: ListSet): the lists to compact
+        lock (:obj: threading.Lock): held while compacting, the lock the
+            server holds while writing to the lists
+
+    Returns:
+        the started thread
+    """
+    def compact_forever():
+        while True:
+            time.sleep(interval)
+            with lock:
+                try:
+                    files = list(lists.by_name().items())
+                except Exception:
+                    logger.exception('could not read the lists to compact')
+                    continue
+                for list_name, textobjectfile in files:
+                    try:
+                        textobjectfile.compact(threshold)
+                    except Exception:
+                        logger.exception(f'could not compact {list_name}')
+    thread = Thread(target=compact_forever, name='compaction', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,105 @@
+"""Reading and querying lists over http, in pages or as a stream of NDJSON
+
+Responses carry an ETag and Last-Modified taken from the size and mtime
+of the list's file and its tombstones (or the version of a database), a
+request whose If-None-Match still matches is answered with 304 Not
+Modified after a stat of the files.
+"""
+from email.utils import formatdate
+from cap.store.textobjectfiles import without_end
+import json
+
+NOT_MODIFIED = 304
+NDJSON = 'application/x-ndjson'
+
+
+def validators(textobjectfile):
+    """the ETag and Last-Modified headers for a list, from its
+    `TextObjectFile.modified`
+
+    Returns:
+        a dict of the headers
+    """
+    version, mtime_ns = textobjectfile.modified()
+    return {
+            'ETag': f'"{version:x}-{mtime_ns:x}"',
+            'Last-Modified': formatdate(mtime_ns / 1e9, usegmt=True),
+    }
+
+
+def not_modified(if_none_match, etag):
+    """whether an If-None-Match header matches the current ETag"""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in tags or etag in tags
+
+
+def page(textobjectfile, offset=0, limit=None):
+    """a page of a list
+
+    Args:
+        textobjectfile (:obj: TextObjectFile): the list
+        offset (int): the position of the first entry
+        limit (int): the most entries to return, defaults to all of them
+
+    Returns:
+        a dict with the entries' text, without surrounding whitespace, in
+        'items', the offset and the total number of entries in the list
+    """
+    offset = int(offset)
+    stop = None if limit is None else offset + int(limit)
+    if offset < 0 or (stop is not None and stop < offset):
+        raise ValueError('offset and limit must not be negative')
+    return {
+            'items': [str(entry).strip() for entry in textobjectfile[offset:stop]],
+            'offset': offset,
+            'total': len(textobjectfile),
+    }
+
+
+def ndjson(textobjectfile, chunk_size=1 << 16):
+    """stream a whole list as NDJSON, one JSON string per entry with its
+    text without surrounding whitespace
+
+    Yields:
+        chunks of about `chunk_size` characters
+    """
+    chunk, size = [], 0
+    for entry in without_end(textobjectfile.entries(lazy=True)):
+        line = json.dumps(str(entry).strip()) + '\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def query(lists, args):
+    """query the lists with the arguments of a request. `list` is a comma
+    separated list of the lists to query, every other argument is a
+    condition for `ListSet.query` such as `item__prefix=foo`
+
+    Returns:
+        a dict with a {'list': name, 'entry': text} result for each match
+    """
+    conditions = dict(args)
+    names = conditions.pop('list', None)
+    names = None if names is None else names.split(',')
+    return {'results': [{'list': name, 'entry': str(entry).strip()}
+            for name, entry in lists.query(lists=names, **conditions)]}
+
+
+def search(lists, args):
+    """search the lists for the words in the `q` argument of a request,
+    `list` optionally names the lists to search, comma separated
+
+    Returns:
+        a dict with a {'list': name, 'entry': text} result for each match
+    """
+    names = args.get('list')
+    names = None if names is None else names.split(',')
+    return {'results': [{'list': name, 'entry': str(entry).strip()}
+            for name, entry in lists.search(args.get('q', ''), lists=names)]}
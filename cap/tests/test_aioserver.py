@@ -0,0 +1,116 @@
+from cap.lists.lists import ListSet
+from cap.store.textobjects import ToDo
+from cap.taskserver import aioserver
+from cap.metrics import subscribe, unsubscribe
+from pathlib import Path
+import asyncio
+import unittest
+
+LISTS_DIR = Path('/tmp/testaioserver')
+
+
+async def writes(*queued):
+    """submit writes together so that all but the first queue up behind
+    it, returning the exception raised by each or None"""
+    results = await asyncio.gather(*(aioserver.write(*write) for write in queued), return_exceptions=True)
+    return [None if result is None else type(result) for result in results]
+
+
+class TestWriters(unittest.TestCase):
+    def setUp(self):
+        self.lists = ListSet(LISTS_DIR/'index.txt', LISTS_DIR, tombstones=True)
+        for name in ('todos', 'other'):
+            if name in self.lists:
+                del self.lists[name]
+            self.lists.add(name, ToDo)
+        self.served, aioserver.lists = aioserver.lists, self.lists
+        aioserver.writers.clear()
+
+    def tearDown(self):
+        aioserver.lists = self.served
+        aioserver.writers.clear()
+
+    def items(self, name='todos'):
+        return [todo.item for todo in self.lists[name]]
+
+    def test_coalesced_in_order(self):
+        events = []
+        subscribe(events.append, 'textobjectfile.*')
+        try:
+            results = asyncio.run(writes(
+                ('todos', 'add', ['TODO: a', 'TODO: x']),
+                ('todos', 'replace', {'TODO: a': 'TODO: b'}),
+                ('todos', 'replace', {'TODO: b': 'TODO: c'}),
+                ('todos', 'replace', {'TODO: x': 'TODO: y'}),
+                ('todos', 'replace', {'TODO: x': 'TODO: z'}),
+                ('todos', 'remove', ['TODO: y']),
+                ('todos', 'replace', {'TODO: y': 'TODO: w'}),
+            ))
+        finally:
+            unsubscribe(events.append)
+        assert results == [None, None, None, None, ValueError, None, ValueError]
+        assert self.items() == ['c']
+        assert [e.name for e in events if e.name != 'textobjectfile.read'] == [
+                'textobjectfile.add', 'textobjectfile.apply']
+
+    def test_retry_failed_add(self):
+        results = asyncio.run(writes(
+            ('todos', 'add', ['TODO: a']),
+            ('todos', 'add', ['TODO: b']),
+            ('todos', 'add', ['not a todo']),
+            ('todos', 'add', ['TODO: c']),
+        ))
+        assert results == [None, None, ValueError, None]
+        assert self.items() == ['a', 'b', 'c']
+
+    def test_tombstoned_removes(self):
+        self.lists['todos'].add('TODO: a', 'TODO: b')
+        results = asyncio.run(writes(
+            ('todos', 'add', ['TODO: c']),
+            ('todos', 'remove', ['TODO: a']),
+            ('todos', 'remove', ['TODO: missing']),
+            ('todos', 'remove', ['TODO: b']),
+        ))
+        assert results == [None, None, ValueError, None]
+        assert self.items() == ['c'] and self.lists['todos'].dead_ratio() > 0
+
+    def test_per_list_locks(self):
+        async def blocked():
+            async with aioserver.list_writer('todos').lock:
+                await asyncio.wait_for(aioserver.write('other', 'add', ['TODO: other']), 5)
+                waiting = asyncio.create_task(aioserver.write('todos', 'add', ['TODO: todo']))
+                await asyncio.sleep(0.1)
+                assert not waiting.done()
+            await waiting
+        asyncio.run(blocked())
+        assert self.items('other') == ['other'] and self.items() == ['todo']
+
+    def test_delete_waits_for_writes(self):
+        async def deleting():
+            async with aioserver.list_writer('todos').lock:
+                deleted = asyncio.create_task(aioserver.delete(None, 'todos'))
+                await asyncio.sleep(0.1)
+                assert not deleted.done() and 'todos' in self.lists
+            await deleted
+        asyncio.run(deleting())
+        assert 'todos' not in self.lists and 'todos' not in aioserver.writers
+
+    def test_compactor_survives_errors(self):
+        def corrupt():
+            raise ValueError('corrupt sidecar')
+        self.lists['todos'].dead_ratio = corrupt
+        other = self.lists['other']
+        other.add('TODO: a', 'TODO: b')
+        other.remove('TODO: a')
+        async def compacting():
+            compactor = asyncio.create_task(aioserver.compactor(interval=0))
+            await asyncio.sleep(0.2)
+            assert not compactor.done()
+            compactor.cancel()
+        with self.assertLogs('cap.taskserver.compaction', 'ERROR'):
+            asyncio.run(compacting())
+        assert other.dead_ratio() == 0 and self.items('other') == ['b']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+from cap.lists.lists import ListSet
+from cap.taskserver.batch import run_batch
+from pathlib import Path
+import unittest
+
+LISTS_DIR = Path('/tmp/testbatch')
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.lists = ListSet(LISTS_DIR/'index.txt', LISTS_DIR, tombstones=True)
+        for name in ('todos', 'other'):
+            if name in self.lists:
+                del self.lists[name]
+
+    def test_results(self):
+        results = run_batch(self.lists, [
+            {'op': 'create', 'list': 'todos', 'type': 'ToDo'},
+            {'op': 'add', 'list': 'todos', 'items': ['TODO: a', 'TODO: b']},
+            {'op': 'remove', 'list': 'todos', 'items': ['TODO: missing']},
+            {'op': 'replace', 'list': 'todos', 'items': {'TODO: a': 'TODO: aa'}},
+            {'op': 'add', 'list': 'todos', 'items': ['not a todo']},
+            {'op': 'rename', 'list': 'todos'},
+            {'op': 'add', 'list': 'nolist', 'items': ['TODO: c']},
+        ])
+        assert [result['ok'] for result in results] == [True, True, False, True, False, False, False]
+        assert 'TODO: missing' in results[2]['error']
+        assert [todo.item for todo in self.lists['todos']] == ['aa', 'b']
+
+    def test_flush_before_create_and_delete(self):
+        results = run_batch(self.lists, [
+            {'op': 'create', 'list': 'todos', 'type': 'ToDo'},
+            {'op': 'add', 'list': 'todos', 'items': ['TODO: gone']},
+            {'op': 'delete', 'list': 'todos'},
+            {'op': 'create', 'list': 'todos', 'type': 'ToDo'},
+            {'op': 'add', 'list': 'todos', 'items': ['TODO: kept']},
+            {'op': 'create', 'list': 'other', 'type': 'ToDo'},
+            {'op': 'add', 'list': 'other', 'items': ['TODO: other']},
+        ])
+        assert all(result['ok'] for result in results)
+        assert [todo.item for todo in self.lists['todos']] == ['kept']
+        assert [todo.item for todo in self.lists['other']] == ['other']
+
+
+if __name__ == '__main__':
+    unittest.main()
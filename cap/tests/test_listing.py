@@ -0,0 +1,73 @@
+from cap.lists.lists import ListSet
+from cap.store.textobjects import ToDo, Line
+from cap.taskserver import aioserver
+from cap.taskserver.listing import validators, not_modified, page, ndjson
+from pathlib import Path
+import asyncio
+import json
+import unittest
+
+LISTS_DIR = Path('/tmp/testlisting')
+
+
+def get(target, headers=None):
+    """the (status, headers, body) of a GET request to the aioserver"""
+    return asyncio.run(aioserver.dispatch(aioserver.Request('GET', target, headers or {}, b'')))
+
+
+class TestListing(unittest.TestCase):
+    def setUp(self):
+        self.lists = ListSet(LISTS_DIR/'index.txt', LISTS_DIR, tombstones=True, snapshot=True, index=True)
+        if 'todos' in self.lists:
+            del self.lists['todos']
+        self.lists.add('todos', ToDo)
+        self.todos = self.lists['todos']
+        self.todos.add(*[f'TODO: {i}' for i in range(5)])
+        self.served, aioserver.lists = aioserver.lists, self.lists
+
+    def tearDown(self):
+        aioserver.lists = self.served
+
+    def test_validators(self):
+        headers = validators(self.todos)
+        assert not_modified(headers['ETag'], headers['ETag'])
+        assert not_modified(f'"other", W/{headers["ETag"]}', headers['ETag'])
+        assert not not_modified(None, headers['ETag'])
+        self.todos.remove('TODO: 1')
+        assert validators(self.todos)['ETag'] != headers['ETag']
+
+    def test_page(self):
+        assert page(self.todos, 1, 2) == {'items': ['TODO: 1', 'TODO: 2'], 'offset': 1, 'total': 5}
+        assert page(self.todos, 4)['items'] == ['TODO: 4']
+        with self.assertRaises(ValueError):
+            page(self.todos, -1)
+
+    def test_end_match(self):
+        if 'lines' in self.lists:
+            del self.lists['lines']
+        self.lists.add('lines', Line)
+        lines = self.lists['lines']
+        assert page(lines) == {'items': [], 'offset': 0, 'total': 0}
+        lines.add('a', 'b', 'c')
+        assert page(lines) == {'items': ['a', 'b', 'c'], 'offset': 0, 'total': 3}
+        assert [json.loads(line) for line in ''.join(ndjson(lines)).splitlines()] == ['a', 'b', 'c']
+        lines.remove('b')
+        assert page(lines, 1) == {'items': ['c'], 'offset': 1, 'total': 2}
+
+    def test_ndjson(self):
+        streamed = ''.join(ndjson(self.todos, chunk_size=10))
+        assert [json.loads(line) for line in streamed.splitlines()] == [f'TODO: {i}' for i in range(5)]
+
+    def test_read(self):
+        status, headers, body = get('/list/todos?offset=3&limit=10')
+        assert status == 200 and json.loads(body)['items'] == ['TODO: 3', 'TODO: 4']
+        status, _, body = get('/list/todos', {'if-none-match': headers['ETag']})
+        assert status == 304 and body == ''
+        status, headers, body = get('/list/todos?format=ndjson')
+        assert status == 200 and headers['Content-Type'] == 'application/x-ndjson'
+        assert json.loads(next(body).splitlines()[0]) == 'TODO: 0'
+        assert get('/list/missing')[0] == 404
+
+
+if __name__ == '__main__':
+    unittest.main()
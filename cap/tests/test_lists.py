@@ -1,6 +1,7 @@
 from cap.lists import lists
-from cap.store.textobjects import ToDo
+from cap.store.textobjects import ToDo, Line
 from cap.lists.lists import ListSet
+from cap.store.search import SearchIndex
 from pathlib import Path
 import unittest
 
@@ -22,6 +23,64 @@ class TestLists(unittest.TestCase):
         del testlistset[testlist]
         assert not txtobjfile.path.exists()
 
+    def test_by_name_cached(self):
+        testlistset = ListSet(Path('/tmp/testlistset.txt'), Path('/tmp/testlists'))
+        testlistset.add('cachedlist', ToDo)
+        cachedlist = testlistset['cachedlist']
+        assert testlistset['cachedlist'] is cachedlist
+        other = ListSet(Path('/tmp/testlistset.txt'), Path('/tmp/testlists'))
+        other.add('otherlist', ToDo)
+        assert 'otherlist' in testlistset
+        del testlistset['cachedlist']
+        assert 'cachedlist' not in testlistset
+        del testlistset['otherlist']
+
+    def test_convert(self):
+        testlistset = ListSet(Path('/tmp/testlistset.txt'), Path('/tmp/testlists'))
+        if 'convertlist' in testlistset:
+            del testlistset['convertlist']
+        testlistset.add('convertlist', Line)
+        testlistset['convertlist'].add('line a', 'line b')
+        testlistset.convert('convertlist', 'sqlite')
+        assert [str(e) for e in testlistset['convertlist']] == ['line a', 'line b']
+        testlistset['convertlist']._rewritten()
+        for backend in ('segmented', 'text'):
+            testlistset.convert('convertlist', backend)
+            assert testlistset['convertlist'].backend == backend
+        assert testlistset['convertlist'].path.read_text() == 'line a\nline b\n'
+        del testlistset['convertlist']
+
+    def test_query_index(self):
+        testlistset = ListSet(Path('/tmp/testlistset.txt'), Path('/tmp/testlists'), tombstones=True,
+                indexed_attributes=['item'])
+        for name in ('querylist', 'otherquerylist'):
+            if name in testlistset:
+                del testlistset[name]
+        testlistset.add('querylist', ToDo)
+        querylist = testlistset['querylist']
+        querylist.add('TODO: buy milk', 'TODO: bake')
+        assert [e.item for _, e in testlistset.query(item__prefix='b', lists=['querylist'])] == ['buy milk', 'bake']
+        testlistset.add('otherquerylist', ToDo)
+        assert testlistset['querylist'] is querylist
+        querylist.remove('TODO: bake')
+        assert querylist.attribute_indexes['item'].signature == querylist._signature()
+        assert [e.item for _, e in testlistset.query(item__prefix='b')] == ['buy milk']
+        del testlistset['otherquerylist']
+        del testlistset['querylist']
+
+    def test_search(self):
+        testlistset = ListSet(Path('/tmp/testlistset.txt'), Path('/tmp/testlists'),
+                SearchIndex(Path('/tmp/testsearch.sqlite3')))
+        testlistset.add('searchlist', ToDo)
+        searchlist = testlistset['searchlist']
+        searchlist.add('TODO: buy milk', 'TODO: call home')
+        assert [str(e).strip() for _, e in testlistset.search('milk')] == ['TODO: buy milk']
+        searchlist.add('TODO: more milk')
+        searchlist.remove('TODO: buy milk')
+        assert [str(e).strip() for _, e in testlistset.search('Milk')] == ['TODO: more milk']
+        del testlistset['searchlist']
+        assert testlistset.search('milk') == []
+
 
 
 
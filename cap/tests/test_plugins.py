@@ -0,0 +1,61 @@
+from cap.plugins import TextObjectTypes
+from pathlib import Path
+import hashlib
+import json
+import shutil
+import unittest
+
+PLUGINS_DIR = Path('/tmp/testplugins')
+MANIFEST_PATH = Path('/tmp/testplugins_manifest.json')
+
+
+class TestTextObjectTypes(unittest.TestCase):
+    """the manifest is written by hand so that the plugin is only ever
+    imported by the lookup in `test_import_on_first_lookup`"""
+    def setUp(self):
+        shutil.rmtree(PLUGINS_DIR, ignore_errors=True)
+        PLUGINS_DIR.mkdir()
+        self.plugin = PLUGINS_DIR/'widgets.py'
+        self.plugin.write_text("from cap.store.textobjects import createtxtobj\n"
+                "Widget = createtxtobj('Widget', 'WIDGET $name')\n")
+        st = self.plugin.stat()
+        self.write({str(self.plugin): {'hash': hashlib.sha256(self.plugin.read_bytes()).hexdigest(),
+                'types': ['Widget'], 'mtime': st.st_mtime_ns, 'size': st.st_size}})
+
+    def manifest(self):
+        return json.loads(MANIFEST_PATH.read_text())
+
+    def write(self, manifest):
+        MANIFEST_PATH.write_text(json.dumps(manifest))
+
+    def rewrite(self, **changes):
+        manifest = self.manifest()
+        manifest[str(self.plugin)].update(changes)
+        self.write(manifest)
+
+    def test_import_on_first_lookup(self):
+        types = TextObjectTypes(PLUGINS_DIR, MANIFEST_PATH)
+        assert 'Widget' in types.plugins() and not types.modules
+        assert types['Widget'].match('WIDGET gear').name == 'gear'
+        assert self.plugin in types.modules
+
+    def test_trusted_by_mtime_and_size(self):
+        self.rewrite(types=['Gadget'])
+        types = TextObjectTypes(PLUGINS_DIR, MANIFEST_PATH)
+        assert types.plugins() == {'Gadget': self.plugin} and not types.modules
+
+    def test_hash_fallback(self):
+        self.rewrite(types=['Gadget'], mtime=0)
+        types = TextObjectTypes(PLUGINS_DIR, MANIFEST_PATH)
+        assert types.plugins() == {'Gadget': self.plugin} and not types.modules
+        assert self.manifest()[str(self.plugin)]['mtime'] == self.plugin.stat().st_mtime_ns
+
+    def test_deleted_plugin(self):
+        self.plugin.unlink()
+        types = TextObjectTypes(PLUGINS_DIR, MANIFEST_PATH)
+        assert types.plugins() == {} and not types.modules
+        assert self.manifest() == {}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,364 @@
+from cap.store.textobjectfiles import TextObjectFile, TextObjectFileGroup
+from cap.store.textobjects import Line, ToDo, createtxtobj, literal_prefix, prefilter, prefiltered_finditer
+from cap.store.scanner import Scanner
+from cap.store import parallel
+from cap.store.parsecache import ParseCache
+from cap.store.sqlitefiles import SQLiteTextObjectFile
+from cap.store.snapshot import Snapshot
+from cap.store.segments import SegmentedTextObjectFile
+from cap.store.search import SearchIndex
+from cap.utils import chunks, filesignature
+from cap.metrics import Collector, subscribe, unsubscribe
+from io import BytesIO
+from pathlib import Path
+import re
+import os
+import time
+import unittest
+
+STORES_DIR = Path('/tmp/teststores')
+
+
+class TestTextObjectFile(unittest.TestCase):
+    def setUp(self):
+        self.lines = TextObjectFile(STORES_DIR/'lines.txt', Line)
+        self.lines.path.write_text('line 1\nline 2\nline 3\n')
+
+    def test_entries_stream(self):
+        entries = self.lines.entries()
+        first = next(entries)
+        assert str(first) == 'line 1'
+        assert first.span() == (0, 6)
+        assert [str(e) for e in entries][:2] == ['line 2', 'line 3']
+
+    def test_lazy_entries(self):
+        records = list(self.lines.entries(lazy=True))
+        assert str(records[1]) == 'line 2'
+        assert records[1]._textobject is None
+        assert records[1].text == 'line 2'
+        assert records[1].groups == ()
+
+    def test_contains(self):
+        assert 'line 2' in self.lines
+        self.lines.add('line 2', 'line 4', 'line 4', unique=True)
+        assert self.lines.path.read_text().count('line 4') == 1
+        self.lines.remove('line 2')
+        assert 'line 2' not in self.lines
+        assert 'line 4' in self.lines
+
+    def test_query(self):
+        todos = TextObjectFile(STORES_DIR/'todos.txt', ToDo)
+        todos.path.write_text('TODO: buy milk\nTODO: bake\nTODO: call home\n')
+        assert [todo.item for todo in todos.query(item__prefix='b')] == ['buy milk', 'bake']
+        todos.index_attribute('item')
+        assert [todo.item for todo in todos.query(item='bake')] == ['bake']
+        todos.add('TODO: bike')
+        assert [todo.item for todo in todos.query(item__prefix='bi')] == ['bike']
+        assert [todo.item for todo in todos.query(item__prefix='b')] == ['buy milk', 'bake', 'bike']
+        assert [todo.item for todo in todos.query(item__regex='^ca')] == ['call home']
+
+    def test_query_index_changes(self):
+        todos = TextObjectFile(STORES_DIR/'todos.txt', ToDo, tombstones=True)
+        todos.path.write_text('TODO: buy milk\nTODO: bake\nTODO: call home\nTODO: bake\n')
+        todos.tombstones.clear()
+        todos.index_attribute('item')
+        attribute_index = todos.attribute_indexes['item']
+        assert [todo.item for todo in todos.query(item__prefix='b')] == ['buy milk', 'bake', 'bake']
+        todos.remove('TODO: bake')
+        todos.batch(replace={'TODO: call home': 'TODO: bike'})
+        assert attribute_index.signature == todos._signature()
+        assert [todo.item for todo in todos.query(item__prefix='b')] == ['buy milk', 'bike']
+        todos.apply([('add', ['TODO: boat']), ('replace', {'TODO: buy milk': 'TODO: call'}),
+            ('remove', ['TODO: bike'])])
+        assert attribute_index.signature == todos._signature()
+        assert [todo.item for todo in todos.query(item__prefix='b')] == ['boat']
+        assert [todo.item for todo in todos.query(item='call')] == ['call']
+        assert [todo.item for todo in todos] == ['call', 'boat']
+
+    def test_index(self):
+        lines = TextObjectFile(self.lines.path, Line, index=True)
+        assert len(lines) == 3
+        assert str(lines[1]) == 'line 2'
+        lines.add('line 4')
+        assert lines.index.path.exists()
+        assert [str(e) for e in lines[2:4]] == ['line 3', 'line 4']
+        assert len(lines) == len(self.lines)
+
+    def test_cache(self):
+        cache = ParseCache()
+        lines = TextObjectFile(self.lines.path, Line, cache=cache)
+        first = list(lines)
+        cached = cache.entries(lines.path, Line)
+        lines.add('line 4')
+        entries = list(lines)
+        assert entries[0] is first[0]
+        assert [str(e) for e in cached] == ['line 1', 'line 2', 'line 3', '']
+        assert [str(e) for e in lines.entries(lazy=True)] == [str(e) for e in entries]
+        assert [str(e) for e in entries] == ['line 1', 'line 2', 'line 3', 'line 4', '']
+        lines.replace('line 4', 'line 5')
+        assert str(list(lines)[3]) == 'line 5'
+
+    def test_cache_limit(self):
+        cache = ParseCache(max_entries=6)
+        others = TextObjectFile(STORES_DIR/'others.txt', Line, cache=cache)
+        others.path.write_text('other 1\nother 2\n')
+        lines = TextObjectFile(self.lines.path, Line, cache=cache)
+        list(lines), list(others)
+        assert cache.size == 3 and len(cache.parses) == 1
+        assert [str(e) for e in lines] == ['line 1', 'line 2', 'line 3', '']
+        assert cache.size == 4 and list(cache.parses)[0][0] == lines.path.resolve()
+
+    def test_batch(self):
+        self.lines.add('line 10')
+        self.lines.batch(remove=['line 1', 'line 3'], replace={'line 2': 'line 20'})
+        assert self.lines.path.read_text() == 'line 20\nline 10\n'
+        with self.assertRaises(ValueError):
+            self.lines.remove('line 1')
+
+    def test_tombstones(self):
+        todos = TextObjectFile(STORES_DIR/'tombstones.txt', ToDo, tombstones=True)
+        todos.path.write_text('TODO: a\nTODO: b\nTODO: a\n')
+        todos.tombstones.clear()
+        mtime, modified = os.stat(todos.path).st_mtime_ns, todos.modified()
+        todos.remove('TODO: a')
+        assert todos.path.read_text() == 'TODO: a\nTODO: b\nTODO: a\n'
+        assert os.stat(todos.path).st_mtime_ns == mtime and todos.modified() != modified
+        assert [todo.item for todo in todos] == ['b'] and len(todos) == 1
+        assert 'TODO: a' not in todos
+        todos.add('TODO: a')
+        assert [str(todo).strip() for todo in todos.entries(lazy=True)] == ['TODO: b', 'TODO: a']
+        assert todos.compact()
+        assert todos.path.read_text() == 'TODO: b\nTODO: a\n'
+
+    def test_tombstoned_positions(self):
+        for options in ({'index': True}, {'snapshot': True}, {'cache': ParseCache()}):
+            todos = TextObjectFile(STORES_DIR/'positions.txt', ToDo, tombstones=True, **options)
+            todos.path.write_text(''.join(f'TODO: {i}\n' for i in range(10)) + 'TODO: 1\n')
+            todos.tombstones.clear()
+            assert len(todos) == 11 and 'TODO: 1' in todos
+            events = []
+            subscribe(events.append, 'parse.*')
+            try:
+                todos.remove('TODO: 3', 'TODO: 1')
+                assert len(todos) == 8 and [todo.item for todo in todos[1:4]] == ['2', '4', '5']
+                todos.remove('TODO: 7')
+                assert len(todos) == 7 and todos[-1].item == '9' and todos[4].item == '6'
+            finally:
+                unsubscribe(events.append)
+            assert not events, options
+            todos.add('TODO: 1')
+            assert [todo.item for todo in todos[-3:]] == ['8', '9', '1'] and len(todos) == 8
+
+    def test_apply_tombstones(self):
+        todos = TextObjectFile(STORES_DIR/'tombstones.txt', ToDo, tombstones=True)
+        todos.path.write_text('TODO: a\nTODO: b\nTODO: é\n')
+        todos.tombstones.clear()
+        todos.remove('TODO: é', 'TODO: a')
+        todos.add('TODO: a')
+        results = todos.apply([('remove', ['TODO: é']), ('replace', {'TODO: a': 'TODO: aa'}),
+            ('add', ['TODO: c'])])
+        assert isinstance(results[0], ValueError) and results[1:] == [None, None]
+        assert todos.path.read_text() == 'TODO: b\nTODO: aa\nTODO: c\n' and not todos._dead()
+
+
+class TestSearchIndex(unittest.TestCase):
+    def postings(self, index, path):
+        file, _ = index._file(path)
+        return sorted(index.connection.execute('''SELECT token, offset FROM postings
+                JOIN entries ON entries.id = postings.entry WHERE file = ?''', (file,)))
+
+    def test_rewritten(self):
+        path = STORES_DIR/'searched.txt'
+        path.write_text('TODO: buy milk\nTODO: call home\nTODO: é milk\nTODO: bake\n')
+        index = SearchIndex(STORES_DIR/f'search{os.getpid()}.sqlite3')
+        todos = TextObjectFile(path, ToDo, search_index=index)
+        index.refresh(todos)
+        todos.batch(remove=['TODO: buy milk'], replace={'TODO: é milk': 'TODO: more milk please'})
+        todos.apply([('add', ['TODO: milk again']), ('remove', ['TODO: call home']),
+            ('replace', {'TODO: bake': 'TODO: é bake'})])
+        assert index._file(path)[1] == filesignature(path)
+        fresh = SearchIndex(STORES_DIR/f'fresh{os.getpid()}.sqlite3')
+        fresh.refresh(todos)
+        assert self.postings(index, path) == self.postings(fresh, path)
+        assert [str(e).strip() for _, e in index.search('milk', [todos])] == [
+                'TODO: more milk please', 'TODO: milk again']
+        for searched in (index, fresh):
+            searched.connection.close()
+            searched.path.unlink()
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_snapshot(self):
+        todos = TextObjectFile(STORES_DIR/'snapshot.txt', ToDo, snapshot=True)
+        todos.path.write_text('TODO: a\nTODO: é\nTODO: c\n')
+        todos.snapshot.invalidate()
+        parsed = list(TextObjectFile(todos.path, ToDo))
+        assert len(todos) == 3 and todos.snapshot.path.exists()
+        loaded = Snapshot(todos.path, ToDo).entries()
+        assert [(e.item, e.span()) for e in loaded] == [(e.item, e.span()) for e in parsed]
+        assert [e.item for e in todos[1:]] == ['é', 'c']
+        assert [str(e) for e in todos.entries(lazy=True)] == [str(e) for e in parsed]
+        assert [(e.item, e.span()) for e in todos] == [(e.item, e.span()) for e in parsed]
+        cached = TextObjectFile(todos.path, ToDo, cache=ParseCache(), snapshot=True)
+        assert [e.item for e in cached] == ['a', 'é', 'c']
+        todos.add('TODO: d')
+        assert todos[-1].item == 'd' and len(todos) == 4
+
+
+class TestSQLiteTextObjectFile(unittest.TestCase):
+    def test_entries(self):
+        todos = SQLiteTextObjectFile(STORES_DIR/'todos.db', ToDo)
+        todos.delete()
+        todos.add('TODO: a', 'TODO: b', 'TODO: c')
+        todos.batch(remove=['TODO: b'], replace={'TODO: c': 'TODO: cc'})
+        assert [todo.item for todo in todos] == ['a', 'cc'] and len(todos) == 2
+        assert todos[-1].item == 'cc' and 'TODO: a' in todos
+        assert [todo.item for todo in todos.query(item__prefix='c')] == ['cc']
+        with self.assertRaises(ValueError):
+            todos.remove('TODO: b')
+        todos.export_text(STORES_DIR/'todos.txt')
+        assert (STORES_DIR/'todos.txt').read_text() == 'TODO: a\nTODO: cc\n'
+
+
+class TestSegmentedTextObjectFile(unittest.TestCase):
+    def test_segments(self):
+        todos = SegmentedTextObjectFile(STORES_DIR/'segmented.seg', ToDo, segment_size=20)
+        if todos.manifest()['segments']:
+            todos.delete()
+            todos = SegmentedTextObjectFile(STORES_DIR/'segmented.seg', ToDo, segment_size=20)
+        todos.add(*[f'TODO: {i}' for i in range(7)])
+        first, second, third = todos.segments()
+        assert [todo.item for todo in todos] == [str(i) for i in range(7)] and len(todos) == 7
+        assert [todo.item for todo in todos[2:5]] == ['2', '3', '4']
+        unchanged = first.modified(), third.modified()
+        todos.batch(remove=['TODO: 3', 'TODO: 4', 'TODO: 5'])
+        todos[2] = 'TODO: two'
+        assert len(todos.segments()) == 2 and not second.path.exists()
+        assert (first.modified(), third.modified()) != unchanged and third.modified() == unchanged[1]
+        assert [todo.item for todo in todos] == ['0', '1', 'two', '6']
+        with self.assertRaises(ValueError):
+            todos.remove('TODO: 3')
+
+    def test_counts(self):
+        lines = SegmentedTextObjectFile(STORES_DIR/'lines.seg', Line, segment_size=4)
+        if lines.manifest()['segments']:
+            lines.delete()
+            lines = SegmentedTextObjectFile(STORES_DIR/'lines.seg', Line, segment_size=4)
+        lines.add('a', 'b', 'c', 'd', 'e')
+        assert [str(line) for line in lines] == ['a', 'b', 'c', 'd', 'e']
+        assert lines.counts() == [2, 2, 1] and len(lines) == 5
+        assert str(lines[2]) == 'c' and [str(line) for line in lines[1:4]] == ['b', 'c', 'd']
+        lines.remove('c')
+        lines.add('f')
+        assert lines.counts() == [2, 1, 2] and [str(line) for line in lines] == ['a', 'b', 'd', 'e', 'f']
+        manifest = lines.manifest()
+        del manifest['counts']
+        lines._save(manifest)
+        assert lines.counts() == [2, 1, 2] and 'counts' in lines.manifest()
+
+
+class TestTextObjectFileGroup(unittest.TestCase):
+    def test_entries(self):
+        group = TextObjectFileGroup(STORES_DIR/'group.txt')
+        group.file.path.write_text('')
+        todolists = [TextObjectFile(STORES_DIR/f'todolist{i}.txt', ToDo) for i in range(3)]
+        for i, todolist in enumerate(todolists):
+            todolist.path.write_text(f'TODO: {i}a\nTODO: {i}b\n')
+        group.add(*todolists)
+        expected = [todo.item for todolist in todolists for todo in todolist]
+        assert [todo.item for todo in group.entries()] == expected
+        assert [todo.item for todo in group.entries(processes=True)] == expected
+        assert sorted(todo.item for todo in group.entries(ordered=False)) == sorted(expected)
+
+
+class TestParallel(unittest.TestCase):
+    def test_chunks(self):
+        path = STORES_DIR/'chunks.txt'
+        path.write_text('BEGIN a\nb\nEND\nBEGIN c END\nEND\nBEGIN d\n\nEND\n' * 3)
+        Block = createtxtobj('Block', r'BEGIN (?P<name>\w+)(?P<body>[\s\S]*?)END')
+        chunks = [(start, end, parallel.spans(path, Block.regex, start, end))
+                for start, end in parallel.boundaries(path, size=4)]
+        assert len(chunks) > 3
+        offsets = parallel.merge(path, Block, chunks)
+        expected = [m.regs for m in Block.matches(path.read_bytes())]
+        assert offsets.tolist() == [i for regs in expected for span in regs for i in span]
+        entries = TextObjectFile(path, Block).entries(processes=2)
+        assert [e.name for e in entries] == ['a', 'c', 'd'] * 3
+
+
+class TestPrefilter(unittest.TestCase):
+    def test_literal_prefix(self):
+        prefix = lambda pattern, flags=re.MULTILINE: literal_prefix(re.compile(pattern, flags))
+        assert prefix(r'^\[x\] (?P<done>.*)') == '[x] '
+        assert prefix(r'^ab\d') == 'ab'
+        assert prefix(r'^abc?d') == 'ab' and prefix(r'^ab*') == 'a' and prefix(r'^ab{2}') == 'a'
+        assert prefix(r'^a|b') == ''
+        assert prefix(r'^abc', re.IGNORECASE) == ''
+
+    def test_prefiltered_finditer(self):
+        regex = re.compile(r'^TODO: (?P<item>.*)', re.MULTILINE)
+        text = 'x TODO: a\nTODO: b\n  TODO: c\nTODO: d'
+        assert prefilter(regex) == 'TODO: '
+        expected = [m.span() for m in regex.finditer(text)]
+        assert [m.span() for m in prefiltered_finditer(regex, text, 0, prefilter(regex))] == expected
+        assert [m.group('item') for m in prefiltered_finditer(regex, text, 0, 'TODO: ')] == ['b', 'd']
+        found = prefiltered_finditer(re.compile(regex.pattern.encode(), re.MULTILINE), text.encode(), 0, 'TODO: ')
+        assert [m.span() for m in found] == expected
+
+
+class TestScanner(unittest.TestCase):
+    def test_mixed(self):
+        path = STORES_DIR/'mixed.txt'
+        path.write_text('TODO: a\nnote\nTODO: b\n')
+        scanned = [(type(e), str(e).strip()) for e in Scanner(ToDo, Line).entries(path)]
+        assert scanned[:3] == [(ToDo, 'TODO: a'), (Line, 'note'), (ToDo, 'TODO: b')]
+        found = Scanner(ToDo, Line).finditer(b'TODO: \xc3\xa9\n')
+        assert [e.item for e in found if isinstance(e, ToDo)] == ['\xe9']
+
+
+class TestChunks(unittest.TestCase):
+    def test_line_boundaries(self):
+        text = b'line 1\nline 2\nline 3'
+        read = list(chunks(BytesIO(text), size=4))
+        assert b''.join(read) == text
+        assert all(chunk.endswith(b'\n') for chunk in read[:-1])
+        assert read[-1] == b'line 3'
+
+
+class TestMetrics(unittest.TestCase):
+    def test_collector(self):
+        events, collector = [], Collector()
+        subscribe(events.append, 'textobjectfile.*')
+        subscribe(collector)
+        try:
+            lines = TextObjectFile(STORES_DIR/'metrics.txt', Line)
+            lines.path.write_text('')
+            lines.add('line 1', 'line 2')
+            lines.remove('line 1')
+        finally:
+            unsubscribe(events.append)
+            unsubscribe(collector)
+        assert [e.name for e in events] == ['textobjectfile.add', 'textobjectfile.batch']
+        assert events[0].bytes == 14 and events[0].labels == {'list': 'metrics'}
+        rendered = collector.render()
+        assert 'cap_operation_seconds_count{operation="textobjectfile.add",list="metrics"} 1' in rendered
+        assert 'cap_operation_bytes_total{operation="textobjectfile.batch",list="metrics"} 7' in rendered
+
+    def test_parse_timed(self):
+        events = []
+        subscribe(events.append)
+        try:
+            lines = TextObjectFile(STORES_DIR/'metrics.txt', Line)
+            lines.path.write_text('line 1\nline 2\n')
+            for _ in lines:
+                time.sleep(0.05)
+        finally:
+            unsubscribe(events.append)
+        timed = {e.name: e for e in events if e.seconds is not None}
+        assert set(timed) == {'parse.finditer', 'textobjectfile.read'}
+        assert timed['parse.finditer'].labels == {'type': 'Line'}
+        assert timed['textobjectfile.read'].bytes == 14 and timed['textobjectfile.read'].seconds < 0.05
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,57 @@
+from contextlib import contextmanager
+import mmap
+import os
+
+CHUNK_SIZE = 1 << 20
 
 def subclasses(cls):
     for subcls in cls.__subclasses__():
         yield subcls
         yield from subclasses(subcls)
+
+@contextmanager
+def mapped(path):
+    """memory map a file read only
+
+    Args:
+        path (:obj: pathlib.Path): the file to map
+
+    Yields:
+        an `mmap.mmap` over the file, or b'' if the file is empty
+        (empty files cannot be mapped)
+    """
+    with open(path, 'rb') as f:
+        if not f.seek(0, 2):
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
+
+def filesignature(path):
+    """the (inode, size, mtime) of a file, which changes whenever the
+    file is written or replaced"""
+    st = os.stat(path)
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+def chunks(f, size=CHUNK_SIZE):
+    """read a binary file in chunks which end at line boundaries, so that
+    no line is split between two chunks
+
+    Args:
+        f (file): the file to read, opened in binary mode
+        size (int): how many bytes to read at a time. a chunk is longer
+            only when a single line is
+
+    Yields:
+        bytes ending in a newline, apart from the last chunk if the file
+        does not end with one
+    """
+    rest = b''
+    while block := f.read(size):
+        block = rest + block
+        end = block.rfind(b'\n') + 1
+        if end:
+            yield block[:end]
+        rest = block[end:]
+    if rest:
+        yield rest